@@ -0,0 +1,173 @@
+import argparse
+import json
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+
+from peg import (__version__, get_metagrammar, fuse_lexical,
+                 optimize_grammar, generate_parser, compile_parser,
+                 compile_machine)
+from peg.analysis import validate
+
+from cases import SIZES, DEPTHS, cases
+
+
+ENGINES = {
+    "interpreter": generate_parser,
+    "compiled": lambda tree, memoize: compile_parser(tree),
+    "vm": lambda tree, memoize: compile_machine(tree),
+}
+
+
+def _grammar_tree(source, fuse, optimize):
+    tree, end = get_metagrammar().parse(source)
+    if tree is None or end != len(source):
+        raise ValueError("Benchmark grammar does not parse")
+    validate(tree)
+    if optimize:
+        tree = optimize_grammar(tree)
+    if fuse:
+        tree = fuse_lexical(tree)
+    return tree
+
+
+def _run_once(run, text):
+    start = time.perf_counter()
+    res, end = run(text)
+    elapsed = time.perf_counter() - start
+    if res is None or res is False or end != len(text):
+        raise ValueError("Input rejected at offset {}".format(end))
+    return elapsed
+
+
+def _peak_memory(parser, text):
+    tracemalloc.start()
+    try:
+        parser.parse(text)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(parser, text, repeat, memory):
+    parse_time = min(_run_once(parser.parse, text) for _ in range(repeat))
+    match_time = min(_run_once(parser.match, text) for _ in range(repeat))
+    return {
+        "chars": len(text),
+        "parse_time": parse_time,
+        "match_time": match_time,
+        "finalize_time": max(parse_time - match_time, 0.0),
+        "chars_per_sec": len(text) / parse_time,
+        "peak_memory": _peak_memory(parser, text) if memory else None,
+    }
+
+
+def run(args):
+    results = []
+    trees = {}
+    sizes = [size for size in SIZES if size <= args.max_size]
+    for name, grammar, make_input in cases(sizes, DEPTHS):
+        if args.filter and not any(f in name for f in args.filter):
+            continue
+        if grammar not in trees:
+            trees[grammar] = _grammar_tree(grammar, not args.no_fuse,
+                                           not args.no_optimize)
+        text = make_input()
+        repeat = args.repeat if len(text) <= args.max_size // 10 else 1
+        for engine in args.engines:
+            result = {"case": name, "engine": engine}
+            try:
+                parser = ENGINES[engine](trees[grammar], args.memoize)
+                result.update(measure(parser, text, repeat,
+                                      not args.no_memory))
+            except (RecursionError, MemoryError, ValueError) as e:
+                result["error"] = "{}: {}".format(type(e).__name__, e)
+            results.append(result)
+            _print_result(result)
+    return results
+
+
+def _format_memory(value):
+    if value is None:
+        return "-"
+    return "{:.1f} KiB".format(value / 1024)
+
+
+def _print_result(result):
+    if "error" in result:
+        print("{:<22} {:<12} {}".format(result["case"], result["engine"],
+                                        result["error"]))
+    else:
+        print("{:<22} {:<12} {:>10} {:>12.0f} c/s {:>9.3f} ms {:>9.3f} ms "
+              "{:>14}".format(
+                  result["case"], result["engine"], result["chars"],
+                  result["chars_per_sec"], result["parse_time"] * 1000,
+                  result["finalize_time"] * 1000,
+                  _format_memory(result["peak_memory"])))
+    sys.stdout.flush()
+
+
+def compare(results, path):
+    with open(path, "r") as fp:
+        baseline = {(r["case"], r["engine"]): r
+                    for r in json.load(fp)["results"] if "error" not in r}
+    print()
+    print("Speedup against {}:".format(path))
+    for result in results:
+        base = baseline.get((result["case"], result["engine"]))
+        if base is None or "error" in result:
+            continue
+        print("{:<22} {:<12} {:>7.2f}x".format(
+            result["case"], result["engine"],
+            result["chars_per_sec"] / base["chars_per_sec"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PEG parser benchmarks")
+    parser.add_argument("-o", "--output", help="write JSON results to file")
+    parser.add_argument("--compare", help="JSON results to compare against")
+    parser.add_argument("-e", "--engines", nargs="+", default=list(ENGINES),
+                        choices=list(ENGINES))
+    parser.add_argument("-k", "--filter", nargs="+",
+                        help="run only cases containing one of substrings")
+    parser.add_argument("--max-size", type=int, default=SIZES[-1],
+                        help="largest generated input in chars")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--memoize", action="store_true")
+    parser.add_argument("--no-fuse", action="store_true")
+    parser.add_argument("--no-optimize", action="store_true")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the tracemalloc pass")
+    args = parser.parse_args()
+
+    sys.setrecursionlimit(1000000)
+    threading.stack_size(512 << 20)
+    results = []
+    thread = threading.Thread(target=lambda: results.extend(run(args)))
+    thread.start()
+    thread.join()
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump({
+                "version": __version__,
+                "python": platform.python_version(),
+                "implementation": platform.python_implementation(),
+                "machine": platform.machine(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "options": {
+                    "memoize": args.memoize,
+                    "fuse": not args.no_fuse,
+                    "optimize": not args.no_optimize,
+                    "repeat": args.repeat,
+                },
+                "results": results,
+            }, fp, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+import os
+import random
+
+from peg import META_GRAMMAR
+
+
+CALC_GRAMMAR = """
+    Start  <- _ Expr !.
+
+    Expr   <- Mult ((ADD / SUB)<:left Mult:right)*
+    Mult   <- Term ((MUL / DIV)<:left Term:right)*
+    Term   <- LP Expr RP / Number / NEG Term:expr
+
+    Number <- ([0] / [1-9] [0-9]*) @Number<< _
+
+    ADD    <- "+"~ _ @Add
+    SUB    <- "-"~ _ @Sub
+    MUL    <- "*"~ _ @Mul
+    DIV    <- "/"~ _ @Div
+    NEG    <- "-"~ _ @Neg
+    LP     <- "("~ _
+    RP     <- ")"~ _
+    _      <- ([ \t\r\n]*)~
+"""
+
+JSON_GRAMMAR = """
+    Document <- _ Value !.
+
+    Value    <- Object / Array / String / Number / True / False / Null
+    Object   <- LBRACE @Object (Member:item (COMMA Member:item)*)? RBRACE
+    Member   <- String @Member<:key COLON Value:value
+    Array    <- LBRACKET @Array (Value:item (COMMA Value:item)*)? RBRACKET
+
+    String   <- ["]~ (!["\\\\] . / '\\\\' .)* @String<< ["]~ _
+    Number   <- '-'? ([0] / [1-9] [0-9]*) ('.' [0-9]+)?
+                ([eE] ('+' / '-')? [0-9]+)? @Number<< _
+    True     <- 'true'~ @True _
+    False    <- 'false'~ @False _
+    Null     <- 'null'~ @Null _
+
+    LBRACE   <- '{'~ _
+    RBRACE   <- '}'~ _
+    LBRACKET <- '['~ _
+    RBRACKET <- ']'~ _
+    COMMA    <- ','~ _
+    COLON    <- ':'~ _
+    _        <- ([ \t\r\n]*)~
+"""
+
+SIZES = (1 << 10, 10 << 10, 100 << 10, 1 << 20, 10 << 20)
+DEPTHS = (100, 1000)
+
+
+def _grammar_txt():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        os.pardir, "grammar", "grammar.txt")
+    with open(path, "r") as fp:
+        return fp.read()
+
+
+def _calc_expr(rng, depth):
+    r = rng.random()
+    if depth > 6 or r < 0.3:
+        return str(rng.randint(0, 99999))
+    if r < 0.45:
+        return "(" + _calc_expr(rng, depth + 1) + ")"
+    if r < 0.5:
+        return "-" + _calc_expr(rng, depth + 1)
+    return "{} {} {}".format(_calc_expr(rng, depth + 1), rng.choice("+-*/"),
+                             _calc_expr(rng, depth + 1))
+
+
+def _json_value(rng, depth):
+    r = rng.random()
+    if depth > 4 or r < 0.4:
+        return rng.choice((
+            lambda: str(rng.randint(-10 ** 6, 10 ** 6)),
+            lambda: "{:.4e}".format(rng.uniform(-1e3, 1e3)),
+            lambda: '"item \\"{}\\""'.format(rng.randint(0, 999)),
+            lambda: "true", lambda: "false", lambda: "null"))()
+    count = rng.randint(0, 6)
+    if r < 0.7:
+        return "[" + ", ".join(_json_value(rng, depth + 1)
+                               for _ in range(count)) + "]"
+    return "{" + ", ".join('"key{}": {}'.format(i, _json_value(rng, depth + 1))
+                           for i in range(count)) + "}"
+
+
+def _fill(size, item, sep, seed):
+    rng = random.Random(seed)
+    parts = []
+    total = 0
+    while total < size:
+        part = item(rng, 0)
+        parts.append(part)
+        total += len(part) + len(sep)
+    return sep.join(parts)
+
+
+def calc_input(size, seed=0):
+    return _fill(size, _calc_expr, " + ", seed)
+
+
+def json_input(size, seed=0):
+    return "[" + _fill(size, _json_value, ",\n", seed) + "]"
+
+
+def calc_nested(depth):
+    return "(" * depth + "1" + " + 2)" * depth
+
+
+def json_nested(depth):
+    return '{"a": [' * depth + "0" + "]}" * depth
+
+
+def _size_name(size):
+    for unit, scale in (("MB", 1 << 20), ("KB", 1 << 10)):
+        if size >= scale and size % scale == 0:
+            return "{}{}".format(size // scale, unit)
+    return "{}B".format(size)
+
+
+def cases(sizes=SIZES, depths=DEPTHS):
+    yield "meta/META_GRAMMAR", META_GRAMMAR, lambda: META_GRAMMAR
+    yield "meta/grammar.txt", META_GRAMMAR, _grammar_txt
+    for size in sizes:
+        yield ("calc/" + _size_name(size), CALC_GRAMMAR,
+               lambda size=size: calc_input(size))
+    for size in sizes:
+        yield ("json/" + _size_name(size), JSON_GRAMMAR,
+               lambda size=size: json_input(size))
+    for depth in depths:
+        yield ("calc/nested-{}".format(depth), CALC_GRAMMAR,
+               lambda depth=depth: calc_nested(depth))
+        yield ("json/nested-{}".format(depth), JSON_GRAMMAR,
+               lambda depth=depth: json_nested(depth))
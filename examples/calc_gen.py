@@ -1,4 +1,5 @@
-from peg import metagrammar, infer_types, gen_converter, generate_py_parser
+from peg import (metagrammar, infer_types, gen_converter,
+                 generate_compiled_py_parser)
 
 
 def main():
@@ -25,7 +26,7 @@ def main():
     types = infer_types(tree)
     with open("calc_generated.py", "w") as fp:
         fp.write("from peg import *\n\n\n")
-        fp.write(generate_py_parser(tree))
+        fp.write(generate_compiled_py_parser(tree))
         fp.write("\n\n\n")
         for t, d in types.items():
             fp.write(d.gen())
@@ -57,8 +58,9 @@ class ExpressionVisitor(ClassVisitor):
 
 def main():
     parser = make_parser()
-    tree, rest = parser.parse("(2 + 2 * (3 + -1)) / 3 * 2")
-    assert not rest
+    source = "(2 + 2 * (3 + -1)) / 3 * 2"
+    tree, end = parser.parse(source)
+    assert end == len(source)
     tree = ConverterVisitor().visit(tree)
     print(ExpressionVisitor().visit(tree))
 
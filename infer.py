@@ -4,8 +4,8 @@ from peg import metagrammar, infer_types
 def main():
     with open("grammar/grammar.txt", "r") as fp:
         text = fp.read()
-    tree, rest = metagrammar.parse(text)
-    assert tree and not rest
+    tree, end = metagrammar.parse(text)
+    assert tree and end == len(text)
     types = infer_types(tree)
     for t, d in types.items():
         print(d.gen())
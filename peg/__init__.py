@@ -1,5 +1,20 @@
+from .version import __version__
 from .peg import *
 from .visitor import *
 from .generate import *
+from .compiler import *
+from .vm import *
+from .stream import *
+from .incremental import *
+from .parallel import *
+from .serialize import *
+from .optimize import *
 from .grammar import *
 from .typing import *
+
+
+def __getattr__(name):
+    if name == "metagrammar":
+        return get_metagrammar()
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name))
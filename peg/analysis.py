@@ -2,7 +2,8 @@ from .visitor import Visitor, GenericVisitor
 from .boolean import *
 
 
-__all__ = ("bad_references", "well_formed", "validate")
+__all__ = ("bad_references", "misplaced_cuts", "well_formed", "validate",
+           "First", "first_sets")
 
 
 class References(GenericVisitor):
@@ -33,6 +34,24 @@ def bad_references(grammar):
     return list(ref.redefined), list(ref.referenced - ref.defined)
 
 
+def _misplaced_cut(node, alt):
+    if node.name == "Cut":
+        return not alt
+    if node.name == "Sequence" and alt:
+        return any(_misplaced_cut(item, False)
+                   for item in node.values("item") if item.name != "Cut")
+    if node.name == "Choice":
+        return any(_misplaced_cut(item, True) for item in node.values("alt"))
+    if node.name in ("Optional", "Repeat", "Repeat1"):
+        return _misplaced_cut(node["expr"], True)
+    return any(_misplaced_cut(v, False) for _, v in node)
+
+
+def misplaced_cuts(grammar):
+    return [rule["name"].value for rule in grammar.values("rule")
+            if _misplaced_cut(rule["body"], False)]
+
+
 class Nullable(Visitor):
     def visit_Grammar(self, node):
         equations = {}
@@ -53,6 +72,9 @@ class Nullable(Visitor):
     def visit_Epsilon(self, node):
         return true
 
+    def visit_Cut(self, node):
+        return true
+
     def visit_And(self, node):
         return self.visit(node["expr"])
 
@@ -120,6 +142,150 @@ class Nullable(Visitor):
 _nullable = Nullable()
 
 
+def _union(a, b):
+    if a is None or b is None:
+        return None
+    return a | b
+
+
+class First(Visitor):
+    MAX_CLASS_SIZE = 256
+
+    def __init__(self):
+        self._rules = {}
+
+    def visit_Grammar(self, node):
+        rules = node.values("rule")
+        self._rules = {
+            rule["name"].value: (frozenset(), False) for rule in rules
+        }
+        changed = True
+        while changed:
+            changed = False
+            for rule in rules:
+                name = rule["name"].value
+                first = self.visit(rule["body"])
+                if first != self._rules[name]:
+                    self._rules[name] = first
+                    changed = True
+        return dict(self._rules)
+
+    def visit_Rule(self, node):
+        raise NotImplementedError("visit_Rule")
+
+    def visit_Choice(self, node):
+        chars, nullable = frozenset(), False
+        for alt in node.values("alt"):
+            c, n = self.visit(alt)
+            chars = _union(chars, c)
+            nullable = nullable or n
+        return chars, nullable
+
+    def visit_Sequence(self, node):
+        chars = frozenset()
+        for item in node.values("item"):
+            c, n = self.visit(item)
+            chars = _union(chars, c)
+            if not n:
+                return chars, False
+        return chars, True
+
+    def visit_Epsilon(self, node):
+        return frozenset(), True
+
+    def visit_Cut(self, node):
+        return frozenset(), True
+
+    def visit_And(self, node):
+        return frozenset(), True
+
+    def visit_Not(self, node):
+        return frozenset(), True
+
+    def visit_Optional(self, node):
+        return self.visit(node["expr"])[0], True
+
+    def visit_Repeat(self, node):
+        return self.visit(node["expr"])[0], True
+
+    def visit_Repeat1(self, node):
+        return self.visit(node["expr"])
+
+    def visit_Append(self, node):
+        return self.visit(node["expr"])
+
+    def visit_Rappend(self, node):
+        return self.visit(node["expr"])
+
+    def visit_Extend(self, node):
+        return self.visit(node["expr"])
+
+    def visit_Rextend(self, node):
+        return self.visit(node["expr"])
+
+    def visit_Ignore(self, node):
+        return self.visit(node["expr"])
+
+    def visit_Regex(self, node):
+        return self.visit(node["expr"])
+
+    def visit_Identifier(self, node):
+        return self._rules[node.value]
+
+    def visit_Tag(self, node):
+        return frozenset(), True
+
+    def visit_Literal(self, node):
+        chars = node.values("char")
+        if not chars:
+            return frozenset(), True
+        return frozenset(self.visit(chars[0])), False
+
+    def visit_Class(self, node):
+        chars = frozenset()
+        for item in node.values("item"):
+            chars = _union(chars, self.visit(item)[0])
+        return chars, False
+
+    def visit_Nothing(self, node):
+        return frozenset(), False
+
+    def visit_Range(self, node):
+        start = ord(self.visit(node["start"]))
+        end = ord(self.visit(node["end"]))
+        if end - start >= self.MAX_CLASS_SIZE:
+            return None, False
+        return frozenset(chr(c) for c in range(start, end + 1)), False
+
+    def visit_Char(self, node):
+        return frozenset(self.visit(node["char"])), False
+
+    def visit_escape(self, node):
+        return {
+            "n": "\n",
+            "r": "\r",
+            "t": "\t",
+            "'": "'",
+            '"': '"',
+            "[": "[",
+            "]": "]",
+            "\\": "\\",
+        }[node.value]
+
+    def visit_octal(self, node):
+        return chr(int(node.value, 8))
+
+    def visit_char(self, node):
+        return node.value
+
+    def visit_Any(self, node):
+        return None, False
+
+
+def first_sets(grammar):
+    return First().visit(grammar)
+
+
 class WellFormed(Visitor):
     def visit_Grammar(self, node):
         equations = _nullable.visit(node)
@@ -146,6 +312,9 @@ class WellFormed(Visitor):
     def visit_Epsilon(self, node):
         return true
 
+    def visit_Cut(self, node):
+        return true
+
     def visit_And(self, node):
         return self.visit(node["expr"])
 
@@ -233,6 +402,11 @@ def validate(grammar):
     if undefined:
         raise ValueError(
             "Rules {} undefined".format(", ".join(sorted(undefined))))
+    misplaced = misplaced_cuts(grammar)
+    if misplaced:
+        raise ValueError(
+            "Rules {} use cut outside of an alternative".format(
+                ", ".join(sorted(misplaced))))
     bad = well_formed(grammar)
     if bad:
         raise ValueError(
@@ -0,0 +1,493 @@
+from .visitor import Visitor
+from .analysis import First
+from .generate import (ParserVisitor, class_ranges, dispatch_first, has_cut,
+                       literal_run, merged_literal, negated_class)
+from .peg import CharClass, CharRange, _error
+from .tree import *
+
+
+__all__ = ("CompiledParser", "generate_compiled_py_parser", "compile_parser")
+
+
+def _note(e, pos, expected):
+    if e[2]:
+        return
+    if pos > e[0]:
+        e[0] = pos
+        e[1] = [expected]
+    elif pos == e[0] and expected not in e[1]:
+        e[1] = e[1] + [expected]
+
+
+class CompiledParser:
+    __slots__ = ("_rule", "_recognizer", "_checker", "_source")
+
+    def __init__(self, rule, recognizer, checker, source=None):
+        self._rule = rule
+        self._recognizer = recognizer
+        self._checker = checker
+        self._source = source
+
+    def __reduce__(self):
+        if self._source is None:
+            raise TypeError("Cannot pickle a parser without its source")
+        return _load_compiled, (self._source,)
+
+    def parse(self, s, pos=0):
+        res, end = self._rule(s, len(s), pos, EMPTY)
+        if res is None:
+            return None, pos
+        return res.finalize(), end
+
+    def match(self, s, pos=0):
+        res, end = self._recognizer(s, len(s), pos, True)
+        if res is None:
+            return False, pos
+        return True, end
+
+    def parse_strict(self, s, pos=0):
+        e = [-1, [], 0]
+        res, end = self._checker(s, len(s), pos, EMPTY, e)
+        if res is None:
+            raise _error(s, pos, None, e[0], e[1])
+        if end != len(s):
+            raise _error(s, pos, end, e[0], e[1])
+        return res.finalize()
+
+
+class PyCompiler(Visitor):
+    MAX_DEPTH = 32
+    MAX_LOOPS = 8
+
+    def __init__(self):
+        self._counter = 0
+        self._helpers = []
+        self._constants = []
+        self._imports = set()
+        self._first = First()
+        self._recognize = False
+        self._check = False
+
+    def _var(self, prefix):
+        self._counter += 1
+        return "{}{}".format(prefix, self._counter)
+
+    def _function(self, name, compile):
+        lines = ["def {}(s, l, p, t{}):".format(
+            name, ", e" if self._check else "")]
+        lines.extend(self._indent(compile("t", "p", 1, 0)))
+        lines.append("    return t, p")
+        return "\n".join(lines)
+
+    def _indent(self, lines):
+        return ["    " + line for line in lines]
+
+    def _guard(self, compile, t, p, depth, loops):
+        if depth > self.MAX_DEPTH or loops > self.MAX_LOOPS:
+            name = self._var("_expr")
+            self._helpers.append(self._function(name, compile))
+            return self._call(name, t, p)
+        return compile(t, p, depth, loops)
+
+    def _call(self, name, t, p):
+        return ["{1}, {2} = {0}(s, l, {2}, {1}{3})".format(
+            name, t, p, ", e" if self._check else "")]
+
+    def _note(self, p, expected):
+        if not self._check:
+            return []
+        return ["_note(e, {}, {!r})".format(p, expected)]
+
+    def _compile(self, node, t, p, depth, loops):
+        method = getattr(self, "compile_" + node.name)
+        return self._guard(
+            lambda t, p, depth, loops: method(node, t, p, depth, loops),
+            t, p, depth, loops)
+
+    def _nested(self, node, t, p, depth, loops):
+        return self._indent(self._compile(node, t, p, depth + 1, loops))
+
+    def _sub(self, node, p, depth, loops, on_fail, on_success, mute=False):
+        t1, p1 = self._var("t"), self._var("p")
+        lines = ["{}, {} = {}, {}".format(
+            t1, p1, "True" if self._recognize else "EMPTY", p)]
+        if mute:
+            lines.append("e[2] += 1")
+        lines.extend(self._compile(node, t1, p1, depth, loops))
+        if mute:
+            lines.append("e[2] -= 1")
+        if on_fail is None:
+            lines.append("if {} is not None:".format(t1))
+            lines.extend(self._indent(on_success(t1, p1)))
+            return lines
+        lines.append("if {} is None:".format(t1))
+        lines.extend(self._indent(on_fail(t1, p1)))
+        if on_success is not None:
+            lines.append("else:")
+            lines.extend(self._indent(on_success(t1, p1)))
+        return lines
+
+    def visit_Grammar(self, node):
+        self._first.visit(node)
+        rules = []
+        for rule in node.values("rule"):
+            rules.append(self.visit(rule))
+        self._recognize = True
+        for rule in node.values("rule"):
+            rules.append(self.visit(rule))
+        self._recognize, self._check = False, True
+        for rule in node.values("rule"):
+            rules.append(self.visit(rule))
+        start = node.values("rule")[0]["name"].value
+        imports = [
+            "from peg.compiler import CompiledParser, _note",
+            "from peg.tree import EMPTY, Named",
+        ]
+        if "CharClass" in self._imports:
+            imports.insert(1, "from peg.peg import CharClass")
+        if "re" in self._imports:
+            imports.insert(0, "import re\n")
+        header = ["\n".join(imports)]
+        if self._constants:
+            header.append("\n".join(self._constants))
+        return "\n\n\n".join(header + self._helpers + rules + [
+            "def make_parser():\n"
+            "    return CompiledParser(parse_{0}, match_{0}, "
+            "check_{0})".format(start)
+        ])
+
+    def _rule(self, name):
+        if self._check:
+            return "check_" + name
+        return ("match_" if self._recognize else "parse_") + name
+
+    def visit_Rule(self, node):
+        return self._function(
+            self._rule(node["name"].value),
+            lambda t, p, depth, loops:
+                self._compile(node["body"], t, p, depth, loops))
+
+    def compile_Sequence(self, node, t, p, depth, loops):
+        return self._sequence(node.values("item"), t, p, depth, loops)
+
+    def _sequence(self, items, t, p, depth, loops):
+        if items[0].name == "Cut":
+            if len(items) == 1:
+                return ["pass"]
+            lines = self._sequence(items[1:], t, p, depth, loops)
+            lines.extend([
+                "if {} is None:".format(t),
+                "    {} = -1".format(p),
+            ])
+            return lines
+        negated = negated_class(items, 0)
+        run = None if self._check else literal_run(items, 0)
+        if negated is not None:
+            lines = self._test("{0} < l and s[{0}] not in {1}".format(
+                p, self._class(negated)), t, p,
+                CharClass(class_ranges(self, negated), True)._expected())
+            items = items[1:]
+        elif run is not None:
+            lines = self._compile(merged_literal(*run), t, p, depth, loops)
+            items = items[len(run[1]) - 1:]
+        else:
+            lines = self._compile(items[0], t, p, depth, loops)
+        if len(items) > 1:
+            lines.append("if {} is not None:".format(t))
+            lines.extend(self._indent(self._guard(
+                lambda t, p, depth, loops:
+                    self._sequence(items[1:], t, p, depth, loops),
+                t, p, depth + 1, loops)))
+        return lines
+
+    def compile_Choice(self, node, t, p, depth, loops):
+        return self._choices(node.values("alt"), t, p, depth, loops)
+
+    def _choices(self, alts, t, p, depth, loops):
+        t0, p0 = self._var("t"), self._var("p")
+        lines = ["{}, {} = {}, {}".format(t0, p0, t, p)]
+        if len(alts) >= ParserVisitor.DISPATCH_MIN_ALTS and not self._check:
+            firsts = [dispatch_first(self._first, alt) for alt in alts]
+        else:
+            firsts = [None] * len(alts)
+        lines.extend(self._choice(alts, firsts, t, p, t0, p0, depth, loops))
+        return lines
+
+    def _choice(self, alts, firsts, t, p, t0, p0, depth, loops):
+        if firsts[0] is None:
+            lines = self._compile(alts[0], t, p, depth, loops)
+        else:
+            name = self._var("_fs")
+            self._constants.append("{} = frozenset({!r})".format(
+                name, "".join(sorted(firsts[0]))))
+            lines = ["if {0} < l and s[{0}] in {1}:".format(p, name)]
+            lines.extend(self._nested(alts[0], t, p, depth, loops))
+            lines.extend([
+                "else:",
+                "    {} = None".format(t),
+            ])
+        if len(alts) > 1:
+            lines.extend(self._restore(alts[0], t, p, t0, p0))
+            if depth + 1 > self.MAX_DEPTH:
+                lines.extend(self._indent(self._guard(
+                    lambda t, p, depth, loops:
+                        self._choices(alts[1:], t, p, depth, loops),
+                    t, p, depth + 1, loops)))
+            else:
+                lines.extend(self._indent(self._choice(
+                    alts[1:], firsts[1:], t, p, t0, p0, depth + 1, loops)))
+        elif has_cut(alts[0]):
+            lines.extend([
+                "if {} < 0:".format(p),
+                "    {} = {}".format(p, p0),
+            ])
+        return lines
+
+    def _restore(self, node, t, p, t0, p0):
+        lines = []
+        if has_cut(node):
+            lines.extend([
+                "if {} is None and {} < 0:".format(t, p),
+                "    {} = {}".format(p, p0),
+                "elif {} is None:".format(t),
+            ])
+        else:
+            lines.append("if {} is None:".format(t))
+        lines.append("    {}, {} = {}, {}".format(t, p, t0, p0))
+        return lines
+
+    def compile_Cut(self, node, t, p, depth, loops):
+        return ["pass"]
+
+    def compile_Epsilon(self, node, t, p, depth, loops):
+        return ["pass"]
+
+    def compile_Nothing(self, node, t, p, depth, loops):
+        return ["{} = None".format(t)]
+
+    def compile_Any(self, node, t, p, depth, loops):
+        return self._test("{} < l".format(p), t, p, "any character")
+
+    def _span(self, t, start, end):
+        if self._recognize:
+            return []
+        return ["{0} = {0}.extend_span(s, {1}, {2})".format(t, start, end)]
+
+    def _test(self, cond, t, p, expected):
+        lines = ["if {}:".format(cond)]
+        lines.extend(self._indent(self._span(t, p, p + " + 1")))
+        lines.extend([
+            "    {} += 1".format(p),
+            "else:",
+            "    {} = None".format(t),
+        ])
+        lines.extend(self._indent(self._note(p, expected)))
+        return lines
+
+    def compile_Range(self, node, t, p, depth, loops):
+        start, end = self.visit(node["start"]), self.visit(node["end"])
+        return self._test("{0} < l and {1!r} <= s[{0}] <= {2!r}".format(
+            p, start, end), t, p, CharRange(start, end)._expected())
+
+    def compile_Char(self, node, t, p, depth, loops):
+        char = self.visit(node["char"])
+        return self._test("s.startswith({!r}, {})".format(char, p), t, p,
+                          repr(char))
+
+    def compile_Class(self, node, t, p, depth, loops):
+        return self._test("{0} < l and s[{0}] in {1}".format(
+            p, self._class(node)), t, p,
+            CharClass(class_ranges(self, node))._expected())
+
+    def compile_Literal(self, node, t, p, depth, loops):
+        lit = "".join(self.visit(c) for c in node.values("char"))
+        if not lit:
+            return self._span(t, p, p) or ["pass"]
+        lines = ["if s.startswith({!r}, {}):".format(lit, p)]
+        lines.extend(self._indent(
+            self._span(t, p, "{} + {}".format(p, len(lit)))))
+        lines.extend([
+            "    {} += {}".format(p, len(lit)),
+            "else:",
+            "    {} = None".format(t),
+        ])
+        lines.extend(self._indent(self._note(p, repr(lit))))
+        return lines
+
+    def compile_Repeat(self, node, t, p, depth, loops):
+        return self._repeat(node["expr"], t, p, depth, loops, None)
+
+    def _repeat(self, expr, t, p, depth, loops, first):
+        t1, p1 = self._var("t"), self._var("p")
+        lines = [
+            "while True:",
+            "    {}, {} = {}, {}".format(t1, p1, t, p),
+        ]
+        lines.extend(self._nested(expr, t, p, depth, loops + 1))
+        lines.append("    if {} is None:".format(t))
+        if has_cut(expr):
+            lines.extend([
+                "        if {} >= 0:".format(p),
+                "            {} = {}".format(t, t1),
+                "        {} = {}".format(p, p1),
+            ])
+        else:
+            lines.append("        {}, {} = {}, {}".format(t, p, t1, p1))
+        lines.append("        break")
+        if first is not None:
+            lines.append("    {} = False".format(first))
+        return lines
+
+    def compile_Repeat1(self, node, t, p, depth, loops):
+        first = self._var("f")
+        lines = ["{} = True".format(first)]
+        lines.extend(self._repeat(node["expr"], t, p, depth, loops, first))
+        lines.extend([
+            "if {}:".format(first),
+            "    {} = None".format(t),
+        ])
+        return lines
+
+    def compile_Optional(self, node, t, p, depth, loops):
+        t0, p0 = self._var("t"), self._var("p")
+        lines = ["{}, {} = {}, {}".format(t0, p0, t, p)]
+        lines.extend(self._compile(node["expr"], t, p, depth, loops))
+        lines.extend(self._restore(node["expr"], t, p, t0, p0))
+        return lines
+
+    def compile_And(self, node, t, p, depth, loops):
+        return self._sub(node["expr"], p, depth, loops,
+                         lambda t1, p1: ["{} = None".format(t)], None)
+
+    def compile_Not(self, node, t, p, depth, loops):
+        expected = "end of input" if node["expr"].name == "Any" else None
+        return self._sub(node["expr"], p, depth, loops,
+                         None,
+                         lambda t1, p1: ["{} = None".format(t)] +
+                         self._note(p, expected),
+                         self._check)
+
+    def _ast_op(self, node, t, p, depth, loops, update):
+        if self._recognize:
+            return self._compile(node["expr"], t, p, depth, loops)
+        return self._sub(node["expr"], p, depth, loops,
+                         lambda t1, p1: ["{} = None".format(t)],
+                         lambda t1, p1: [
+                             "{} = {}".format(t, update(t1)),
+                             "{} = {}".format(p, p1),
+                         ])
+
+    def _pattern(self, node):
+        name = self._var("_re")
+        self._imports.add("re")
+        self._constants.append("{} = re.compile({!r}, re.DOTALL)".format(
+            name, node["pattern"].value))
+        return name
+
+    def _class(self, node):
+        name = self._var("_cs")
+        chars = CharClass.matcher(class_ranges(self, node))
+        if isinstance(chars, frozenset):
+            value = "frozenset({!r})".format("".join(sorted(chars)))
+        else:
+            self._imports.add("CharClass")
+            value = "CharClass.matcher({!r})".format(chars.ranges())
+        self._constants.append("{} = {}".format(name, value))
+        return name
+
+    def compile_Regex(self, node, t, p, depth, loops):
+        if self._check:
+            return self._compile(node["expr"], t, p, depth, loops)
+        m = self._var("m")
+        lines = [
+            "{} = {}.match(s, {})".format(m, self._pattern(node), p),
+            "if {} is None:".format(m),
+            "    {} = None".format(t),
+        ]
+        if self._recognize:
+            lines.extend([
+                "else:",
+                "    {} = {}.end()".format(p, m),
+            ])
+            return lines
+        lines.extend([
+            "elif {}.end() != {}:".format(m, p),
+            "    {0} = {0}.extend_span(s, {1}, {2}.end())".format(t, p, m),
+            "    {} = {}.end()".format(p, m),
+        ])
+        return lines
+
+    def compile_Ignore(self, node, t, p, depth, loops):
+        if node["expr"].name == "Regex" and not self._check:
+            m = self._var("m")
+            return [
+                "{} = {}.match(s, {})".format(m, self._pattern(node["expr"]),
+                                              p),
+                "if {} is None:".format(m),
+                "    {} = None".format(t),
+                "else:",
+                "    {} = {}.end()".format(p, m),
+            ]
+        return self._ast_op(node, t, p, depth, loops, lambda t1: t)
+
+    def compile_Append(self, node, t, p, depth, loops):
+        return self._ast_op(
+            node, t, p, depth, loops,
+            lambda t1: "{}.append({!r}, {})".format(t, node["name"].value, t1))
+
+    def compile_Extend(self, node, t, p, depth, loops):
+        return self._ast_op(node, t, p, depth, loops,
+                            lambda t1: "{}.extend({})".format(t, t1))
+
+    def compile_Rappend(self, node, t, p, depth, loops):
+        return self._ast_op(
+            node, t, p, depth, loops,
+            lambda t1: "{}.rappend({!r}, {})".format(
+                t1, node["name"].value, t))
+
+    def compile_Rextend(self, node, t, p, depth, loops):
+        return self._ast_op(node, t, p, depth, loops,
+                            lambda t1: "{}.rextend({})".format(t1, t))
+
+    def compile_Tag(self, node, t, p, depth, loops):
+        if self._recognize:
+            return ["pass"]
+        return ["{} = Named({!r})".format(t, node.value)]
+
+    def compile_Identifier(self, node, t, p, depth, loops):
+        return self._call(self._rule(node.value), t, p)
+
+    def visit_escape(self, node):
+        return {
+            "n": "\n",
+            "r": "\r",
+            "t": "\t",
+            "'": "'",
+            '"': '"',
+            "[": "[",
+            "]": "]",
+            "\\": "\\",
+        }[node.value]
+
+    def visit_octal(self, node):
+        return chr(int(node.value, 8))
+
+    def visit_char(self, node):
+        return node.value
+
+
+def generate_compiled_py_parser(grammar):
+    compiler = PyCompiler()
+    return compiler.visit(grammar)
+
+
+def _load_compiled(source):
+    namespace = {}
+    exec(source, namespace)
+    parser = namespace["make_parser"]()
+    parser._source = source
+    return parser
+
+
+def compile_parser(grammar):
+    return _load_compiled(generate_compiled_py_parser(grammar))
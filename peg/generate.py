@@ -1,10 +1,178 @@
 from .visitor import Visitor, GenericVisitor
+from .analysis import First
 from .peg import *
+from .tree import FinalizedNode
 
 
 __all__ = ("generate_visitor", "generate_py_parser", "generate_parser")
 
 
+def class_ranges(visitor, node):
+    if node.name == "Class":
+        items = node.values("item")
+    else:
+        items = [node]
+    ranges = []
+    for item in items:
+        if item.name == "Range":
+            ranges.append((visitor.visit(item["start"]),
+                           visitor.visit(item["end"])))
+        else:
+            c = visitor.visit(item["char"])
+            ranges.append((c, c))
+    return ranges
+
+
+def dispatch_first(first, node):
+    chars, nullable = first.visit(node)
+    if nullable:
+        return None
+    return chars
+
+
+def negated_class(items, i):
+    if i + 1 < len(items) and items[i].name == "Not" and \
+            items[i]["expr"].name in ("Class", "Range", "Char") and \
+            items[i + 1].name == "Any":
+        return items[i]["expr"]
+    return None
+
+
+def _literal_chars(node):
+    if node.name == "Literal":
+        return False, node.values("char")
+    if node.name == "Ignore" and node["expr"].name == "Literal":
+        return True, node["expr"].values("char")
+    return None
+
+
+def literal_run(items, i):
+    first = _literal_chars(items[i])
+    if first is None or not first[1]:
+        return None
+    parts = [first[1]]
+    for item in items[i + 1:]:
+        lit = _literal_chars(item)
+        if lit is None or lit[0] != first[0] or not lit[1]:
+            break
+        parts.append(lit[1])
+    if len(parts) < 2:
+        return None
+    return first[0], parts
+
+
+def merged_literal(ignored, parts):
+    node = FinalizedNode("Literal", [
+        ("char", c) for part in parts for c in part
+    ])
+    if ignored:
+        return FinalizedNode("Ignore", [("expr", node)])
+    return node
+
+
+def has_cut(node):
+    return node.name == "Sequence" and \
+        any(item.name == "Cut" for item in node.values("item"))
+
+
+def contains(node, name):
+    return node.name == name or any(contains(v, name) for _, v in node)
+
+
+def _optional(node):
+    while node.name in ("Ignore", "Append", "Extend", "Rappend", "Rextend"):
+        node = node["expr"]
+    return node.name in ("Optional", "Repeat", "Epsilon", "Tag", "Cut")
+
+
+class Describe(Visitor):
+    def _atom(self, node):
+        if node.name in ("Sequence", "Choice"):
+            return "({})".format(self.visit(node))
+        return self.visit(node)
+
+    def _expr(self, node):
+        return self.visit(node["expr"])
+
+    def _none(self, node):
+        return ""
+
+    def visit_Sequence(self, node):
+        items = node.values("item")
+        while len(items) > 1 and _optional(items[-1]):
+            items = items[:-1]
+        return " ".join(filter(None, (
+            self._atom(item) if item.name == "Choice" else self.visit(item)
+            for item in items)))
+
+    def visit_Choice(self, node):
+        return " / ".join(self.visit(alt) for alt in node.values("alt"))
+
+    def visit_Optional(self, node):
+        return self._atom(node["expr"]) + "?"
+
+    def visit_Repeat(self, node):
+        return self._atom(node["expr"]) + "*"
+
+    def visit_Repeat1(self, node):
+        return self._atom(node["expr"]) + "+"
+
+    def visit_And(self, node):
+        return "&" + self._atom(node["expr"])
+
+    def visit_Not(self, node):
+        return "!" + self._atom(node["expr"])
+
+    visit_Ignore = _expr
+    visit_Append = _expr
+    visit_Extend = _expr
+    visit_Rappend = _expr
+    visit_Rextend = _expr
+    visit_Regex = _expr
+
+    visit_Tag = _none
+    visit_Cut = _none
+
+    def visit_Epsilon(self, node):
+        return "''"
+
+    def visit_Nothing(self, node):
+        return "[]"
+
+    def visit_Identifier(self, node):
+        return node.value
+
+    def visit_Literal(self, node):
+        return "'{}'".format("".join(self.visit(c) for _, c in node))
+
+    def visit_Class(self, node):
+        return "[{}]".format("".join(self.visit(item)[1:-1]
+                                     for item in node.values("item")))
+
+    def visit_Range(self, node):
+        return "[{}-{}]".format(self.visit(node["start"]),
+                                self.visit(node["end"]))
+
+    def visit_Char(self, node):
+        return "[{}]".format(self.visit(node["char"]))
+
+    def visit_Any(self, node):
+        return "."
+
+    def visit_escape(self, node):
+        return "\\" + node.value
+
+    def visit_octal(self, node):
+        return "\\" + node.value
+
+    def visit_char(self, node):
+        return node.value
+
+
+def describe(node):
+    return Describe().visit(node)
+
+
 class Tags(GenericVisitor):
     def __init__(self):
         self.tags = []
@@ -30,28 +198,42 @@ def generate_visitor(grammar):
 class PyParserVisitor(Visitor):
     def visit_Grammar(self, node):
         rules = [
-            "def make_parser():",
-            "    g = Grammar()",
+            "def make_parser(memoize=False):",
+            "    g = Grammar(memoize)",
         ]
         for rule in node.values("rule"):
             rules.append("    " + self.visit(rule))
         rules.extend([
+            "    g.freeze()",
             "    return g({!r})".format(node.values("rule")[0]["name"].value)
         ])
         return "\n".join(rules)
 
     def visit_Rule(self, node):
-        return "g({!r}, {})".format(node["name"].value,
-                                    self.visit(node["body"]))
+        body = node["body"]
+        if body.name == "Regex":
+            return "g({!r}, {})".format(
+                node["name"].value, self._regex(body, node["name"].value))
+        return "g({!r}, {})".format(node["name"].value, self.visit(body))
 
     def visit_Sequence(self, node):
-        items = []
-        for item in node.values("item"):
+        return self._sequence(node.values("item"))
+
+    def _sequence(self, items):
+        parts = []
+        for i, item in enumerate(items):
+            if item.name == "Cut":
+                parts.append("Cut({})".format(
+                    self._sequence(items[i + 1:]) or "Epsilon()"))
+                break
             if item.name in ("Choice", "Class"):
-                items.append("({})".format(self.visit(item)))
+                parts.append("({})".format(self.visit(item)))
             else:
-                items.append(self.visit(item))
-        return " * ".join(items)
+                parts.append(self.visit(item))
+        return " * ".join(parts)
+
+    def visit_Cut(self, node):
+        return "Epsilon()"
 
     def visit_Choice(self, node):
         alts = []
@@ -60,10 +242,7 @@ class PyParserVisitor(Visitor):
         return " | ".join(alts)
 
     def visit_Class(self, node):
-        items = []
-        for item in node.values("item"):
-            items.append(self.visit(item))
-        return " | ".join(items)
+        return "CharClass({!r})".format(class_ranges(self, node))
 
     def visit_Repeat(self, node):
         if node["expr"].name in ("Sequence", "Choice", "Not", "Class"):
@@ -134,6 +313,13 @@ class PyParserVisitor(Visitor):
     def visit_Any(self, node):
         return "Any()"
 
+    def visit_Regex(self, node):
+        return self._regex(node, describe(node["expr"]))
+
+    def _regex(self, node, name):
+        return "Regex({!r}, {!r}, {})".format(
+            node["pattern"].value, name, self.visit(node["expr"]))
+
     def visit_escape(self, node):
         return {
             "n": "\n",
@@ -159,49 +345,121 @@ def generate_py_parser(grammar):
 
 
 class ParserVisitor(Visitor):
-    def __init__(self):
-        self.grammar = Grammar()
+    DISPATCH_MIN_ALTS = 3
+
+    def __init__(self, memoize=False, nomemo=(), binary=False, profile=False):
+        self.memoize = memoize
+        self.nomemo = frozenset(nomemo)
+        self.binary = binary
+        self.profile = profile
+        self.grammar = Grammar(memoize, profile)
+        self.first = First()
+        self.checkpoints = False
+
+    def _char(self, c):
+        if not self.binary:
+            return c
+        if ord(c) > 0xff:
+            raise ValueError("Character {!r} is not a byte".format(c))
+        return ord(c)
+
+    def _first(self, node):
+        first = dispatch_first(self.first, node)
+        if first is None or not self.binary:
+            return first
+        return frozenset(ord(c) for c in first if ord(c) <= 0xff)
+
+    def _literal(self, chars, parts=()):
+        if self.binary:
+            return ByteLiteral(bytes(chars), parts)
+        return Literal("".join(chars), parts)
+
+    def _merged(self, ignored, parts):
+        chars = [[self.visit(c) for c in part] for part in parts]
+        expr = self._literal([c for part in chars for c in part],
+                             [self._literal(part) for part in chars])
+        return Ignore(expr) if ignored else expr
 
     def visit_Grammar(self, node):
-        self.grammar = Grammar()
+        self.grammar = Grammar(self.memoize, self.profile)
+        self.first = First()
+        self.first.visit(node)
+        self.checkpoints = self.memoize and contains(node, "Cut")
         for rule in node.values("rule"):
             self.visit(rule)
+        self.grammar.freeze()
         return self.grammar(node.values("rule")[0]["name"].value)
 
     def visit_Rule(self, node):
-        self.grammar(node["name"].value, self.visit(node["body"]))
+        name = node["name"].value
+        body = node["body"]
+        if body.name == "Regex":
+            expr = self._regex(body, name)
+        else:
+            expr = self.visit(body)
+        self.grammar(name, expr, False if name in self.nomemo else None)
 
     def visit_Choice(self, node):
         items = node.values("alt")
-        alt = self.visit(items[-1])
-        for item in reversed(items[:-1]):
-            alt = Choice(self.visit(item), alt)
-        return alt
+        if len(items) >= self.DISPATCH_MIN_ALTS:
+            firsts = [self._first(item) for item in items]
+            if any(first is not None for first in firsts):
+                return self._checkpoint(
+                    Dispatch([self.visit(item) for item in items], firsts))
+        return self._checkpoint(Choice(*[self.visit(item) for item in items]))
+
+    def _checkpoint(self, expr):
+        if self.checkpoints:
+            return Checkpoint(expr)
+        return expr
 
     def visit_Sequence(self, node):
-        items = node.values("item")
-        seq = self.visit(items[-1])
-        for item in reversed(items[:-1]):
-            seq = Sequence(self.visit(item), seq)
-        return seq
+        return self._sequence(node.values("item"))
+
+    def _sequence(self, items):
+        exprs = []
+        i = 0
+        while i < len(items):
+            if items[i].name == "Cut":
+                exprs.append(Cut(self._sequence(items[i + 1:])))
+                break
+            negated = negated_class(items, i)
+            run = literal_run(items, i)
+            if negated is not None:
+                exprs.append(CharClass(class_ranges(self, negated), True))
+                i += 2
+            elif run is not None:
+                exprs.append(self._merged(*run))
+                i += len(run[1])
+            else:
+                exprs.append(self.visit(items[i]))
+                i += 1
+        if not exprs:
+            return Epsilon()
+        if len(exprs) == 1:
+            return exprs[0]
+        return Sequence(*exprs)
 
     def visit_Epsilon(self, node):
         return Epsilon()
 
+    def visit_Cut(self, node):
+        return Epsilon()
+
     def visit_And(self, node):
-        return And(self.visit(node["expr"]))
+        return self._checkpoint(And(self.visit(node["expr"])))
 
     def visit_Not(self, node):
-        return Not(self.visit(node["expr"]))
+        return self._checkpoint(Not(self.visit(node["expr"])))
 
     def visit_Optional(self, node):
-        return Optional(self.visit(node["expr"]))
+        return self._checkpoint(Optional(self.visit(node["expr"])))
 
     def visit_Repeat(self, node):
-        return Repeat(self.visit(node["expr"]))
+        return Repeat(self._checkpoint(self.visit(node["expr"])))
 
     def visit_Repeat1(self, node):
-        return Repeat1(self.visit(node["expr"]))
+        return Repeat1(self._checkpoint(self.visit(node["expr"])))
 
     def visit_Append(self, node):
         return Append(self.visit(node["expr"]), node["name"].value)
@@ -225,14 +483,10 @@ class ParserVisitor(Visitor):
         return Tag(node.value)
 
     def visit_Literal(self, node):
-        return Literal("".join(self.visit(n) for n in node.values("char")))
+        return self._literal([self.visit(n) for n in node.values("char")])
 
     def visit_Class(self, node):
-        items = node.values("item")
-        alt = self.visit(items[-1])
-        for item in reversed(items[:-1]):
-            alt = Choice(self.visit(item), alt)
-        return alt
+        return CharClass(class_ranges(self, node))
 
     def visit_Nothing(self, node):
         return Nothing()
@@ -241,10 +495,10 @@ class ParserVisitor(Visitor):
         return CharRange(self.visit(node["start"]), self.visit(node["end"]))
 
     def visit_Char(self, node):
-        return Literal(self.visit(node["char"]))
+        return self._literal([self.visit(node["char"])])
 
     def visit_escape(self, node):
-        return {
+        return self._char({
             "n": "\n",
             "r": "\r",
             "t": "\t",
@@ -253,18 +507,28 @@ class ParserVisitor(Visitor):
             "[": "[",
             "]": "]",
             "\\": "\\",
-        }[node.value]
+        }[node.value])
 
     def visit_octal(self, node):
-        return chr(int(node.value, 8))
+        return self._char(chr(int(node.value, 8)))
 
     def visit_char(self, node):
-        return node.value
+        return self._char(node.value)
 
     def visit_Any(self, node):
         return Any()
 
+    def visit_Regex(self, node):
+        return self._regex(node, describe(node["expr"]))
+
+    def _regex(self, node, name):
+        pattern = node["pattern"].value
+        if self.binary:
+            pattern = pattern.encode("latin-1")
+        return Regex(pattern, name, self.visit(node["expr"]))
+
 
-def generate_parser(grammar):
-    visitor = ParserVisitor()
+def generate_parser(grammar, memoize=False, nomemo=(), binary=False,
+                    profile=False):
+    visitor = ParserVisitor(memoize, nomemo, binary, profile)
     return visitor.visit(grammar)
@@ -1,9 +1,15 @@
+import os
+import sys
+
 from .analysis import validate
 from .generate import generate_parser
+from .optimize import fuse_lexical, optimize_grammar
 from .peg import *
+from .serialize import FORMAT_VERSION, dump_parser, load_parser
+from .version import __version__
 
 
-__all__ = ("META_GRAMMAR", "metagrammar", "parse_grammar")
+__all__ = ("META_GRAMMAR", "get_metagrammar", "parse_grammar")
 
 
 def _make_bootstrap_grammar():
@@ -41,7 +47,7 @@ def _make_bootstrap_grammar():
     g('Primary',
         g('Identifier') * ~g('LEFTARROW') |
         g('OPEN') * g('Expression') * g('CLOSE') |
-        g('Literal') | g('Class') | g('Any') | g('Tag'))
+        g('Literal') | g('Class') | g('Any') | g('Tag') | g('Cut'))
     g('Identifier',
         g('IdentStart') * g('IdentCont').rep() *
         Tag('Identifier').rext() * g('Spacing'))
@@ -78,12 +84,13 @@ def _make_bootstrap_grammar():
         (Literal('n') | Literal('r') | Literal('t') | Literal("'") |
          Literal('"') | Literal('[') | Literal(']') | Literal('\\')) *
         Tag('escape').rext() |
-        Literal('\\').ign() * CharRange('0', '2') *
+        Literal('\\').ign() * CharRange('0', '3') *
         CharRange('0', '7') * CharRange('0', '7') * Tag('octal').rext() |
         Literal('\\').ign() * CharRange('0', '7') *
         CharRange('0', '7').opt() * Tag('octal').rext() |
         ~Literal('\\') * Any() * Tag('char').rext())
     g('Any', g('DOT') * Tag('Any'))
+    g('Cut', g('CUT') * Tag('Cut'))
     g('LEFTARROW', Literal('<-').ign() * g('Spacing'))
     g('SLASH', Literal('/').ign() * g('Spacing'))
     g('AND', Literal('&').ign() * g('Spacing'))
@@ -99,6 +106,7 @@ def _make_bootstrap_grammar():
     g('LAPPEND', Literal(':').ign() * g('Spacing'))
     g('RAPPEND', Literal('<:').ign() * g('Spacing'))
     g('IGNORE', Literal('~').ign() * g('Spacing'))
+    g('CUT', Literal('^').ign() * g('Spacing'))
     g('Spacing', (g('Space') | g('Comment')).rep())
     g('Comment',
         Literal('#').ign() *
@@ -108,6 +116,7 @@ def _make_bootstrap_grammar():
     g('EndOfLine',
         Literal('\r\n').ign() | Literal('\n').ign() | Literal('\r').ign())
     g('EndOfFile', ~Any())
+    g.freeze()
     return g('Grammar')
 
 
@@ -132,7 +141,7 @@ AstOp      <- Primary ((LAPPEND @Append /
 Primary    <- Identifier !LEFTARROW
             / OPEN Expression CLOSE
             / Literal / Class / Any
-            / Tag
+            / Tag / Cut
 
 # Lexical syntax
 Identifier  <- IdentStart IdentCont* @Identifier<< Spacing
@@ -148,10 +157,11 @@ Class       <- '['~ (!']' Range
                      @Nothing) ']'~ Spacing
 Range       <- Char '-'~ @Range<:start Char:end / Char @Char<:char
 Char        <- '\\'~ [nrt'"\[\]\\] @escape<<
-             / '\\'~ [0-2][0-7][0-7] @octal<<
+             / '\\'~ [0-3][0-7][0-7] @octal<<
              / '\\'~ [0-7][0-7]? @octal<<
              / !'\\' . @char<<
 Any         <- DOT @Any
+Cut         <- CUT @Cut
 
 LEFTARROW   <- '<-'~ Spacing
 SLASH       <- '/'~ Spacing
@@ -168,6 +178,7 @@ REXTEND     <- '<<'~ Spacing
 LAPPEND     <- ':'~ Spacing
 RAPPEND     <- '<:'~ Spacing
 IGNORE      <- '~'~ Spacing
+CUT         <- '^'~ Spacing
 
 Spacing     <- (Space / Comment)*
 Comment     <- '#'~ (!EndOfLine .~)* EndOfLine
@@ -179,18 +190,94 @@ EndOfFile   <- !.
 
 def _make_metagrammar():
     bootstrap = _make_bootstrap_grammar()
-    tree, rest = bootstrap.parse(META_GRAMMAR)
-    assert tree and not rest
+    tree, end = bootstrap.parse(META_GRAMMAR)
+    assert tree and end == len(META_GRAMMAR)
     validate(tree)
-    return generate_parser(tree)
+    return generate_parser(fuse_lexical(optimize_grammar(tree, prune=True)))
+
+
+_metagrammar = None
+
+
+def get_metagrammar():
+    global _metagrammar
+    if _metagrammar is None:
+        _metagrammar = _make_metagrammar()
+    return _metagrammar
+
+
+def __getattr__(name):
+    if name == "metagrammar":
+        return get_metagrammar()
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name))
+
 
+_cache = {}
 
-metagrammar = _make_metagrammar()
 
+def _cache_key(source, *options):
+    import hashlib
+    key = repr((__version__, FORMAT_VERSION, sys.version_info[:2], source,
+                options))
+    return hashlib.sha256(key.encode("utf-8", "surrogatepass")).hexdigest()
 
-def parse_grammar(source):
-    tree, rest = metagrammar.parse(source)
-    if tree is None or rest:
-        raise ValueError()
+
+def _load_cached(path):
+    import pickle
+    import zlib
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        return data, load_parser(data)
+    except (OSError, ValueError, EOFError, ImportError, AttributeError,
+            pickle.UnpicklingError, zlib.error):
+        return None, None
+
+
+def _store_cached(path, data):
+    import tempfile
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _parse_grammar(source, memoize, nomemo, binary, fuse, profile,
+                   optimize):
+    tree = get_metagrammar().parse_strict(source)
     validate(tree)
-    return generate_parser(tree)
+    if optimize:
+        tree = optimize_grammar(tree, 0 if profile else None)
+    if fuse and not profile:
+        tree = fuse_lexical(tree)
+    return generate_parser(tree, memoize, nomemo, binary, profile)
+
+
+def parse_grammar(source, memoize=False, nomemo=(), binary=False,
+                  fuse=True, cache=False, cache_dir=None, profile=False,
+                  optimize=True):
+    if not cache and cache_dir is None:
+        return _parse_grammar(source, memoize, nomemo, binary, fuse, profile,
+                              optimize)
+    key = _cache_key(source, memoize, sorted(nomemo), binary, fuse, profile,
+                     optimize)
+    if key in _cache:
+        return load_parser(_cache[key])
+    data = parser = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, key + ".peg")
+        data, parser = _load_cached(path)
+    if parser is None:
+        parser = _parse_grammar(source, memoize, nomemo, binary, fuse,
+                                profile, optimize)
+        data = dump_parser(parser)
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            _store_cached(path, data)
+    _cache[key] = data
+    return parser
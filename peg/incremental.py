@@ -0,0 +1,108 @@
+from .peg import Context
+from .tree import EMPTY
+
+
+__all__ = ("IncrementalParser",)
+
+
+class EditedMemo:
+    __slots__ = ("_base", "_new", "_start", "_stop", "_delta", "_source",
+                 "depth")
+
+    def __init__(self, base, start, old_len, new_len, source):
+        self._base = base
+        self._new = {}
+        self._start = start
+        self._stop = start + new_len
+        self._delta = new_len - old_len
+        self._source = source
+        self.depth = getattr(base, "depth", 0) + 1
+
+    def _translate(self, expr, pos):
+        if pos < self._start:
+            entry = self._base.get((expr, pos))
+            if entry is None or entry[2] > self._start:
+                return None
+            res, end, reach, fail, expected = entry
+            if res is not None:
+                res = res.relocate(self._source, 0)
+            return res, end, reach, fail, expected
+        if pos >= self._stop:
+            entry = self._base.get((expr, pos - self._delta))
+            if entry is None:
+                return None
+            res, end, reach, fail, expected = entry
+            if res is not None:
+                res = res.relocate(self._source, self._delta)
+            if fail >= 0:
+                fail += self._delta
+            return (res, end + self._delta, reach + self._delta, fail,
+                    expected)
+        return None
+
+    def get(self, key, default=None):
+        entry = self._new.get(key)
+        if entry is None:
+            entry = self._translate(*key)
+            if entry is None:
+                return default
+            self._new[key] = entry
+        return entry
+
+    def __setitem__(self, key, value):
+        self._new[key] = value
+
+    def items(self):
+        for (expr, pos), _ in self._base.items():
+            if pos >= self._start:
+                pos += self._delta
+            key = expr, pos
+            if key not in self._new:
+                self.get(key)
+        return self._new.items()
+
+
+class IncrementalParser:
+    __slots__ = ("_expr", "_source", "_memo")
+
+    MAX_EDITS = 8
+
+    def __init__(self, expr):
+        grammar = getattr(expr, "grammar", None)
+        if grammar is None or not grammar.memoize:
+            raise ValueError(
+                "Incremental parsing needs a grammar built with memoize=True")
+        self._expr = expr
+        self._source = None
+        self._memo = None
+
+    @property
+    def source(self):
+        return self._source
+
+    def parse(self, s):
+        self._source = s
+        self._memo = {}
+        return self._run()
+
+    def edit(self, start, old_len, new_text):
+        old = self._source
+        if start < 0 or old_len < 0 or start + old_len > len(old):
+            raise ValueError("Edit out of range")
+        source = old[:start] + new_text + old[start + old_len:]
+        memo = EditedMemo(self._memo, start, old_len, len(new_text), source)
+        if memo.depth > self.MAX_EDITS:
+            memo = dict(memo.items())
+        self._source = source
+        self._memo = memo
+        return self._run()
+
+    def _run(self):
+        ctx = Context()
+        ctx.memo = self._memo
+        ctx.limit = None
+        ctx.track = True
+        res, end = self._expr._parse(self._source, 0, EMPTY, ctx)
+        if res is None:
+            return None, 0
+        return res.finalize(), end
@@ -0,0 +1,594 @@
+import re
+
+from .visitor import Visitor
+from .tree import FinalizedNode, FinalizedTerm
+from .generate import has_cut
+
+
+__all__ = ("fuse_lexical", "optimize_grammar")
+
+
+def _atomic_supported():
+    try:
+        re.compile("(?>a)*+")
+    except re.error:
+        return False
+    return True
+
+
+_ATOMIC = _atomic_supported()
+
+_TEXT, _SILENT, _EMPTY = "text", "silent", "empty"
+
+_SIMPLE = frozenset(["Literal", "Class", "Char", "Range", "Any", "Nothing",
+                     "Epsilon", "Identifier"])
+
+
+def _combine(modes):
+    res = _EMPTY
+    for mode in modes:
+        if mode is None:
+            return None
+        if mode == _EMPTY:
+            continue
+        if res == _EMPTY:
+            res = mode
+        elif res != mode:
+            return None
+    return res
+
+
+class _Chars(Visitor):
+    def visit_escape(self, node):
+        return {
+            "n": "\n",
+            "r": "\r",
+            "t": "\t",
+            "'": "'",
+            '"': '"',
+            "[": "[",
+            "]": "]",
+            "\\": "\\",
+        }[node.value]
+
+    def visit_octal(self, node):
+        return chr(int(node.value, 8))
+
+    def visit_char(self, node):
+        return node.value
+
+
+_chars = _Chars()
+
+
+class LexicalModes(Visitor):
+    def __init__(self, rules):
+        self._rules = rules
+        self._modes = {}
+        self._active = set()
+
+    def rule(self, name):
+        if name in self._modes:
+            return self._modes[name]
+        if name in self._active:
+            return None
+        self._active.add(name)
+        mode = self.visit(self._rules[name])
+        self._active.discard(name)
+        self._modes[name] = mode
+        return mode
+
+    def visit_Sequence(self, node):
+        return _combine(self.visit(i) for i in node.values("item"))
+
+    def visit_Choice(self, node):
+        return _combine(self.visit(i) for i in node.values("alt"))
+
+    def visit_Epsilon(self, node):
+        return _EMPTY
+
+    def visit_Nothing(self, node):
+        return _EMPTY
+
+    def visit_And(self, node):
+        return None if self.visit(node["expr"]) is None else _EMPTY
+
+    def visit_Not(self, node):
+        return None if self.visit(node["expr"]) is None else _EMPTY
+
+    def visit_Optional(self, node):
+        return self.visit(node["expr"])
+
+    def visit_Repeat(self, node):
+        return self.visit(node["expr"])
+
+    def visit_Repeat1(self, node):
+        return self.visit(node["expr"])
+
+    def visit_Ignore(self, node):
+        mode = self.visit(node["expr"])
+        if mode is None:
+            return None
+        return _EMPTY if mode == _EMPTY else _SILENT
+
+    def visit_Extend(self, node):
+        return self.visit(node["expr"])
+
+    def visit_Append(self, node):
+        return None
+
+    def visit_Rappend(self, node):
+        return None
+
+    def visit_Rextend(self, node):
+        return None
+
+    def visit_Tag(self, node):
+        return None
+
+    def visit_Cut(self, node):
+        return None
+
+    def visit_Identifier(self, node):
+        return self.rule(node.value)
+
+    def visit_Literal(self, node):
+        return _TEXT if node.values("char") else None
+
+    def visit_Class(self, node):
+        return _TEXT
+
+    def visit_Range(self, node):
+        return _TEXT
+
+    def visit_Char(self, node):
+        return _TEXT
+
+    def visit_Any(self, node):
+        return _TEXT
+
+
+class RegexBuilder(Visitor):
+    def __init__(self, rules):
+        self._rules = rules
+
+    def visit_Sequence(self, node):
+        return "".join(self.visit(i) for i in node.values("item"))
+
+    def visit_Choice(self, node):
+        return "(?>{})".format("|".join(self.visit(i)
+                                        for i in node.values("alt")))
+
+    def visit_Epsilon(self, node):
+        return ""
+
+    def visit_Nothing(self, node):
+        return "(?!)"
+
+    def visit_And(self, node):
+        return "(?={})".format(self.visit(node["expr"]))
+
+    def visit_Not(self, node):
+        return "(?!{})".format(self.visit(node["expr"]))
+
+    def visit_Optional(self, node):
+        return "(?:{})?+".format(self.visit(node["expr"]))
+
+    def visit_Repeat(self, node):
+        return "(?:{})*+".format(self.visit(node["expr"]))
+
+    def visit_Repeat1(self, node):
+        return "(?:{})++".format(self.visit(node["expr"]))
+
+    def visit_Ignore(self, node):
+        return self.visit(node["expr"])
+
+    def visit_Extend(self, node):
+        return self.visit(node["expr"])
+
+    def visit_Identifier(self, node):
+        return "(?:{})".format(self.visit(self._rules[node.value]))
+
+    def visit_Literal(self, node):
+        return re.escape("".join(_chars.visit(c) for c in node.values("char")))
+
+    def _class(self, items):
+        parts = []
+        for item in items:
+            if item.name == "Range":
+                start = _chars.visit(item["start"])
+                end = _chars.visit(item["end"])
+                if start <= end:
+                    parts.append("{}-{}".format(re.escape(start),
+                                                re.escape(end)))
+            else:
+                parts.append(re.escape(_chars.visit(item["char"])))
+        if not parts:
+            return "(?!)"
+        return "[{}]".format("".join(parts))
+
+    def visit_Class(self, node):
+        return self._class(node.values("item"))
+
+    def visit_Range(self, node):
+        return self._class([node])
+
+    def visit_Char(self, node):
+        return re.escape(_chars.visit(node["char"]))
+
+    def visit_Any(self, node):
+        return "."
+
+
+class LexicalFusion(Visitor):
+    def __init__(self, rules):
+        self._modes = LexicalModes(rules)
+        self._regex = RegexBuilder(rules)
+
+    def _worth(self, node):
+        if node.name in _SIMPLE:
+            return False
+        if node.name in ("And", "Not", "Ignore", "Extend"):
+            return self._worth(node["expr"])
+        return True
+
+    def _fuse(self, node, mode):
+        regex = FinalizedNode("Regex", [
+            ("pattern", FinalizedTerm("Pattern", self._regex.visit(node))),
+            ("expr", node),
+        ])
+        if mode == _SILENT:
+            return FinalizedNode("Ignore", [("expr", regex)])
+        return regex
+
+    def _expr(self, node):
+        if self._worth(node):
+            mode = self._modes.visit(node)
+            if mode is not None:
+                return self._fuse(node, mode)
+        return self.visit(node)
+
+    def _unary(self, node):
+        return FinalizedNode(node.name, [
+            (n, self._expr(v) if n == "expr" else v) for n, v in node
+        ])
+
+    def _leaf(self, node):
+        return node
+
+    def visit_Grammar(self, node):
+        return FinalizedNode("Grammar", [
+            ("rule", self.visit(rule)) for rule in node.values("rule")
+        ])
+
+    def visit_Rule(self, node):
+        return FinalizedNode("Rule", [
+            ("name", node["name"]),
+            ("body", self._expr(node["body"])),
+        ])
+
+    def visit_Sequence(self, node):
+        items = []
+        run = []
+        run_mode = _EMPTY
+        for item in node.values("item") + [None]:
+            mode = None if item is None else self._modes.visit(item)
+            merged = _combine([run_mode, mode])
+            if merged is not None:
+                run.append(item)
+                run_mode = merged
+                continue
+            if len(run) > 1:
+                items.append(self._fuse(
+                    FinalizedNode("Sequence", [("item", i) for i in run]),
+                    run_mode))
+            else:
+                items.extend(self._expr(i) for i in run)
+            run = []
+            run_mode = _EMPTY
+            if item is None:
+                break
+            if mode is None:
+                items.append(self._expr(item))
+            else:
+                run.append(item)
+                run_mode = mode
+        if len(items) == 1:
+            return items[0]
+        return FinalizedNode("Sequence", [("item", i) for i in items])
+
+    def visit_Choice(self, node):
+        return FinalizedNode("Choice", [
+            ("alt", self._expr(alt)) for alt in node.values("alt")
+        ])
+
+    visit_And = _unary
+    visit_Not = _unary
+    visit_Optional = _unary
+    visit_Repeat = _unary
+    visit_Repeat1 = _unary
+    visit_Ignore = _unary
+    visit_Append = _unary
+    visit_Rappend = _unary
+    visit_Extend = _unary
+    visit_Rextend = _unary
+
+    visit_Epsilon = _leaf
+    visit_Nothing = _leaf
+    visit_Tag = _leaf
+    visit_Cut = _leaf
+    visit_Identifier = _leaf
+    visit_Literal = _leaf
+    visit_Class = _leaf
+    visit_Range = _leaf
+    visit_Char = _leaf
+    visit_Any = _leaf
+
+
+def fuse_lexical(grammar):
+    if not _ATOMIC:
+        return grammar
+    rules = {r["name"].value: r["body"] for r in grammar.values("rule")}
+    return LexicalFusion(rules).visit(grammar)
+
+
+def _references(node, refs):
+    if node.name == "Identifier":
+        refs.add(node.value)
+    for _, v in node:
+        _references(v, refs)
+    return refs
+
+
+def _size(node):
+    return 1 + sum(_size(v) for _, v in node)
+
+
+def _reachable(rules, start):
+    seen = set()
+    stack = [start]
+    while stack:
+        name = stack.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        stack.extend(_references(rules[name], set()))
+    return seen
+
+
+def _post_order(refs):
+    order = []
+    done = set()
+    for root in refs:
+        if root in done:
+            continue
+        done.add(root)
+        stack = [(root, iter(sorted(refs[root])))]
+        while stack:
+            name, pending = stack[-1]
+            for ref in pending:
+                if ref not in done:
+                    done.add(ref)
+                    stack.append((ref, iter(sorted(refs[ref]))))
+                    break
+            else:
+                stack.pop()
+                order.append(name)
+    return order
+
+
+class Silent(Visitor):
+    def __init__(self, rules, order):
+        self._rules = rules
+        self._cache = dict.fromkeys(rules, False)
+        changed = True
+        while changed:
+            changed = False
+            for name in order:
+                if not self._cache[name] and self.visit(rules[name]):
+                    self._cache[name] = True
+                    changed = True
+
+    def rule(self, name):
+        return self._cache[name]
+
+    def _all(self, node):
+        return all(self.visit(v) for _, v in node)
+
+    def _expr(self, node):
+        return self.visit(node["expr"])
+
+    def _true(self, node):
+        return True
+
+    def _false(self, node):
+        return False
+
+    def visit_Identifier(self, node):
+        return self.rule(node.value)
+
+    visit_Sequence = _all
+    visit_Choice = _all
+    visit_Optional = _expr
+    visit_Repeat = _expr
+    visit_Repeat1 = _expr
+
+    visit_Ignore = _true
+    visit_And = _true
+    visit_Not = _true
+    visit_Epsilon = _true
+    visit_Nothing = _true
+    visit_Cut = _true
+
+    visit_Append = _false
+    visit_Rappend = _false
+    visit_Extend = _false
+    visit_Rextend = _false
+    visit_Tag = _false
+    visit_Literal = _false
+    visit_Class = _false
+    visit_Range = _false
+    visit_Char = _false
+    visit_Any = _false
+
+
+def _char_items(node):
+    if node.name == "Literal":
+        chars = [v for _, v in node]
+        if len(chars) == 1:
+            return [FinalizedNode("Char", [("char", chars[0])])]
+        return None
+    if node.name in ("Char", "Range"):
+        return [node]
+    if node.name == "Class":
+        return node.values("item")
+    return None
+
+
+def _char_alt(node):
+    if node.name == "Ignore":
+        items = _char_items(node["expr"])
+        return None if items is None else (True, items)
+    items = _char_items(node)
+    return None if items is None else (False, items)
+
+
+def _wrap(node, ignored):
+    if ignored:
+        return FinalizedNode("Ignore", [("expr", node)])
+    return node
+
+
+class GrammarOptimizer(Visitor):
+    INLINE_SIZE = 12
+
+    def __init__(self, rules, inline_size=None, prune=False):
+        self._rules = rules
+        self._prune = prune
+        refs = {name: _references(body, set()) for name, body in rules.items()}
+        self._order = _post_order(refs)
+        self._silent = Silent(rules, self._order)
+        self._bodies = {}
+        reach = {name: _reachable(rules, name) for name in rules}
+        self._recursive = set(
+            name for name in rules
+            if any(name in reach[ref] for ref in refs[name]))
+        if inline_size is not None:
+            self.INLINE_SIZE = inline_size
+
+    def body(self, name):
+        if name not in self._bodies:
+            self._bodies[name] = self.visit(self._rules[name])
+        return self._bodies[name]
+
+    def _unary(self, node):
+        return FinalizedNode(node.name, [
+            (n, self.visit(v) if n == "expr" else v) for n, v in node
+        ])
+
+    def _leaf(self, node):
+        return node
+
+    def visit_Grammar(self, node):
+        for name in self._order:
+            self.body(name)
+        rules = node.values("rule")
+        if self._prune:
+            live = _reachable(self._rules, rules[0]["name"].value)
+            rules = [rule for rule in rules if rule["name"].value in live]
+        return FinalizedNode("Grammar", [
+            ("rule", self.visit(rule)) for rule in rules
+        ])
+
+    def visit_Rule(self, node):
+        return FinalizedNode("Rule", [
+            ("name", node["name"]),
+            ("body", self.body(node["name"].value)),
+        ])
+
+    def visit_Identifier(self, node):
+        name = node.value
+        if name in self._recursive:
+            return node
+        body = self.body(name)
+        if _size(body) > self.INLINE_SIZE:
+            return node
+        return body
+
+    def visit_Sequence(self, node):
+        items = []
+        for item in node.values("item"):
+            item = self.visit(item)
+            if item.name == "Sequence":
+                items.extend(item.values("item"))
+            elif item.name != "Epsilon":
+                items.append(item)
+        if not items:
+            return FinalizedNode("Epsilon", [])
+        if len(items) == 1:
+            return items[0]
+        return FinalizedNode("Sequence", [("item", i) for i in items])
+
+    def visit_Choice(self, node):
+        alts = []
+        for alt in node.values("alt"):
+            alt = self.visit(alt)
+            if alt.name == "Choice" and \
+                    not any(has_cut(a) for a in alt.values("alt")):
+                alts.extend(alt.values("alt"))
+            else:
+                alts.append(alt)
+        merged = []
+        run = []
+        for alt in alts + [None]:
+            chars = None if alt is None else _char_alt(alt)
+            if chars is not None and (not run or run[0][0] == chars[0]):
+                run.append(chars)
+                continue
+            if len(run) > 1:
+                merged.append(_wrap(FinalizedNode("Class", [
+                    ("item", i) for _, items in run for i in items
+                ]), run[0][0]))
+            else:
+                merged.extend(_wrap(items[0], ignored)
+                              if len(items) == 1 else
+                              _wrap(FinalizedNode("Class", [
+                                  ("item", i) for i in items]), ignored)
+                              for ignored, items in run)
+            run = [] if chars is None else [chars]
+            if alt is not None and chars is None:
+                merged.append(alt)
+        if len(merged) == 1:
+            return merged[0]
+        return FinalizedNode("Choice", [("alt", a) for a in merged])
+
+    def visit_Ignore(self, node):
+        expr = self.visit(node["expr"])
+        if self._silent.visit(expr):
+            return expr
+        return FinalizedNode("Ignore", [("expr", expr)])
+
+    visit_And = _unary
+    visit_Not = _unary
+    visit_Optional = _unary
+    visit_Repeat = _unary
+    visit_Repeat1 = _unary
+    visit_Append = _unary
+    visit_Rappend = _unary
+    visit_Extend = _unary
+    visit_Rextend = _unary
+
+    visit_Epsilon = _leaf
+    visit_Nothing = _leaf
+    visit_Cut = _leaf
+    visit_Tag = _leaf
+    visit_Literal = _leaf
+    visit_Class = _leaf
+    visit_Range = _leaf
+    visit_Char = _leaf
+    visit_Any = _leaf
+
+
+def optimize_grammar(grammar, inline_size=None, prune=False):
+    rules = {r["name"].value: r["body"] for r in grammar.values("rule")}
+    return GrammarOptimizer(rules, inline_size, prune).visit(grammar)
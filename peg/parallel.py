@@ -0,0 +1,101 @@
+import os
+from collections import deque
+
+from .grammar import parse_grammar
+from .tree import FinalizedNamed, FinalizedTerm, FinalizedNode
+
+
+__all__ = ("parse_many",)
+
+
+def _encode(node):
+    if isinstance(node, FinalizedNode):
+        return node.name, [(n, _encode(v)) for n, v in node]
+    if isinstance(node, FinalizedTerm):
+        value = node.value
+        if isinstance(value, memoryview):
+            value = value.tobytes()
+        return node.name, value
+    return node.name
+
+
+def _decode(data):
+    if isinstance(data, str):
+        return FinalizedNamed(data)
+    name, value = data
+    if isinstance(value, list):
+        return FinalizedNode(name, [(n, _decode(v)) for n, v in value])
+    return FinalizedTerm(name, value)
+
+
+def _portable(error):
+    import pickle
+    try:
+        return pickle.loads(pickle.dumps(error))
+    except Exception:
+        return RuntimeError("{}: {}".format(type(error).__name__, error))
+
+
+_parser = None
+
+
+def _init_worker(grammar):
+    global _parser
+    if isinstance(grammar, str):
+        grammar = parse_grammar(grammar)
+    _parser = grammar
+
+
+def _parse_chunk(chunk):
+    results = []
+    for index, s in chunk:
+        try:
+            tree, end = _parser.parse(s)
+        except Exception as e:
+            results.append((index, None, None, _portable(e)))
+        else:
+            if tree is not None:
+                tree = _encode(tree)
+            results.append((index, tree, end, None))
+    return results
+
+
+def _chunks(inputs, chunksize):
+    chunk = []
+    for index, s in enumerate(inputs):
+        if not isinstance(s, (str, bytes, bytearray)):
+            s = bytes(s)
+        chunk.append((index, s))
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def parse_many(grammar, inputs, workers=None, chunksize=16, ordered=True):
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(grammar,)) as executor:
+        pending = deque()
+        chunks = _chunks(inputs, chunksize)
+        while True:
+            for chunk in chunks:
+                pending.append(executor.submit(_parse_chunk, chunk))
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                return
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+            for future in done:
+                for index, tree, end, error in future.result():
+                    if tree is not None:
+                        tree = _decode(tree)
+                    yield index, tree, end, error
@@ -1,13 +1,132 @@
+import re
+from bisect import bisect_right
+from copy import copy
+from time import perf_counter
+
 from .tree import *
 
 
 __all__ = (
-    "Epsilon", "Nothing", "Any", "Literal", "CharRange", "CharSet", "Sequence",
-    "Choice", "Repeat", "Repeat1", "Optional", "And", "Not", "Ignore",
-    "Append", "Extend", "Rappend", "Rextend", "Tag", "Grammar", "Rule"
+    "Epsilon", "Nothing", "Any", "Literal", "ByteLiteral", "CharRange",
+    "CharSet",
+    "RangeTable", "CharClass", "Regex", "Sequence", "Choice", "Dispatch",
+    "Repeat", "Repeat1", "Optional", "And", "Not", "Ignore", "Append",
+    "Extend", "Rappend", "Rextend", "Tag", "Cut", "Checkpoint", "Memo",
+    "Profile", "Grammar", "Rule", "ParseError"
 )
 
 
+class ParseError(ValueError):
+    def __init__(self, pos, line, col, expected):
+        self.pos = pos
+        self.line = line
+        self.col = col
+        self.expected = expected
+        if not expected:
+            what = "Unexpected input"
+        elif len(expected) == 1:
+            what = "Expected " + expected[0]
+        else:
+            what = "Expected {} or {}".format(", ".join(expected[:-1]),
+                                              expected[-1])
+        super().__init__("{} at line {}, column {}".format(what, line, col))
+
+    def __reduce__(self):
+        return ParseError, (self.pos, self.line, self.col, self.expected)
+
+
+_CHUNK = 1 << 16
+
+
+def _error(s, pos, end, fail, expected):
+    if fail >= pos:
+        pos = fail
+    else:
+        expected = []
+    if end is not None and end >= pos:
+        if end > pos:
+            pos, expected = end, []
+        expected = expected + ["end of input"]
+    line, col = _position(s, pos)
+    return ParseError(pos, line, col,
+                      tuple(sorted(set(e for e in expected if e))))
+
+
+def _position(s, pos):
+    if isinstance(s, (str, bytes, bytearray)):
+        nl = "\n" if isinstance(s, str) else b"\n"
+        return s.count(nl, 0, pos) + 1, pos - s.rfind(nl, 0, pos)
+    line, last = 1, -1
+    for start in range(0, pos, _CHUNK):
+        chunk = bytes(s[start:min(start + _CHUNK, pos)])
+        count = chunk.count(b"\n")
+        if count:
+            line += count
+            last = start + chunk.rfind(b"\n")
+    return line, pos - last
+
+
+class Context:
+    __slots__ = ("memo", "reach", "cut", "marks", "limit", "track", "fail",
+                 "expected")
+
+    MEMO_LIMIT = 1 << 16
+
+    def __init__(self):
+        self.memo = {}
+        self.reach = 0
+        self.cut = False
+        self.marks = []
+        self.limit = self.MEMO_LIMIT
+        self.track = False
+        self.fail = -1
+        self.expected = []
+
+    def reached(self, pos):
+        if pos > self.reach:
+            self.reach = pos
+
+    def failed(self, pos, end, expr):
+        if end > self.reach:
+            self.reach = end
+        if pos > self.fail:
+            self.fail = pos
+            self.expected = [expr]
+        elif pos == self.fail and expr not in self.expected:
+            self.expected = self.expected + [expr]
+
+    def failures(self, fail, expected):
+        if fail > self.fail:
+            self.fail = fail
+            self.expected = expected
+        elif fail == self.fail and fail >= 0:
+            self.expected = self.expected + [
+                expr for expr in expected if expr not in self.expected]
+
+    def error(self, s, pos, end=None):
+        return _error(s, pos, end, self.fail,
+                      [e._expected() for e in self.expected])
+
+    def commit(self, pos):
+        marks = self.marks
+        if marks:
+            marks[-1] = None
+        if self.limit is not None and len(self.memo) > self.limit:
+            for mark in marks:
+                if mark is not None:
+                    pos = min(pos, mark)
+                    break
+            self.prune(pos)
+
+    def prune(self, pos):
+        memo = self.memo
+        if type(memo) is not dict:
+            return
+        for key in [key for key in memo if key[1] < pos]:
+            del memo[key]
+        self.limit = max(self.MEMO_LIMIT, 2 * len(memo))
+
+
 class Expression:
     def __mul__(self, other):
         return Sequence(self, other)
@@ -42,46 +161,119 @@ class Expression:
     def ign(self):
         return Ignore(self)
 
-    def parse(self, s):
-        res, tail = self._parse(s, Empty())
+    def parse(self, s, pos=0):
+        res, end = self._parse(s, pos, EMPTY, Context())
+        if res is None:
+            return None, pos
+        return res.finalize(), end
+
+    def match(self, s, pos=0):
+        end = self._match(s, pos, Context())
+        if end is None:
+            return False, pos
+        return True, end
+
+    def parse_strict(self, s, pos=0):
+        ctx = Context()
+        ctx.track = True
+        res, end = self._parse(s, pos, EMPTY, ctx)
         if res is None:
-            return None, s
-        return res.finalize(), tail
+            raise ctx.error(s, pos)
+        if end != len(s):
+            raise ctx.error(s, pos, end)
+        return res.finalize()
+
+    def _expected(self):
+        return None
 
 
 class Epsilon(Expression):
     __slots__ = ()
 
-    def _parse(self, s, tree):
-        return tree, s
+    def _parse(self, s, pos, tree, ctx):
+        return tree, pos
+
+    def _match(self, s, pos, ctx):
+        return pos
 
 
 class Nothing(Expression):
     __slots__ = ()
 
-    def _parse(self, s, tree):
-        return None, s
+    def _parse(self, s, pos, tree, ctx):
+        return None, pos
+
+    def _match(self, s, pos, ctx):
+        return None
 
 
 class Any(Expression):
     __slots__ = ()
 
-    def _parse(self, s, tree):
-        if s:
-            return tree.extend(String(s[0])), s[1:]
-        return None, s
+    def _parse(self, s, pos, tree, ctx):
+        if pos < len(s):
+            return tree.extend_span(s, pos, pos + 1), pos + 1
+        ctx.failed(pos, pos + 1, self)
+        return None, pos
+
+    def _match(self, s, pos, ctx):
+        if pos < len(s):
+            return pos + 1
+        ctx.failed(pos, pos + 1, self)
+        return None
+
+    def _expected(self):
+        return "any character"
 
 
 class Literal(Expression):
-    __slots__ = ("_lit",)
+    __slots__ = ("_lit", "_len", "_parts")
 
-    def __init__(self, lit):
+    def __init__(self, lit, parts=()):
         self._lit = lit
+        self._len = len(lit)
+        self._parts = tuple(parts)
+
+    def _parse(self, s, pos, tree, ctx):
+        if s.startswith(self._lit, pos):
+            end = pos + self._len
+            return tree.extend_span(s, pos, end), end
+        self._failed(s, pos, ctx)
+        return None, pos
+
+    def _match(self, s, pos, ctx):
+        if s.startswith(self._lit, pos):
+            return pos + self._len
+        self._failed(s, pos, ctx)
+        return None
+
+    def _failed(self, s, pos, ctx):
+        for part in self._parts:
+            pos = part._match(s, pos, ctx)
+            if pos is None:
+                return
+        ctx.failed(pos, pos + self._len, self)
+
+    def _expected(self):
+        return repr(self._lit)
+
+
+class ByteLiteral(Literal):
+    __slots__ = ()
+
+    def _parse(self, s, pos, tree, ctx):
+        end = pos + self._len
+        if s[pos:end] == self._lit:
+            return tree.extend_span(s, pos, end), end
+        self._failed(s, pos, ctx)
+        return None, pos
 
-    def _parse(self, s, tree):
-        if s.startswith(self._lit):
-            return tree.extend(String(self._lit)), s[len(self._lit):]
-        return None, s
+    def _match(self, s, pos, ctx):
+        end = pos + self._len
+        if s[pos:end] == self._lit:
+            return end
+        self._failed(s, pos, ctx)
+        return None
 
 
 class CharRange(Expression):
@@ -91,53 +283,266 @@ class CharRange(Expression):
         self._start = start
         self._end = end
 
-    def _parse(self, s, tree):
-        if s and self._start <= s[0] <= self._end:
-            return tree.extend(String(s[0])), s[1:]
-        return None, s
+    def _parse(self, s, pos, tree, ctx):
+        if pos < len(s) and self._start <= s[pos] <= self._end:
+            return tree.extend_span(s, pos, pos + 1), pos + 1
+        ctx.failed(pos, pos + 1, self)
+        return None, pos
+
+    def _match(self, s, pos, ctx):
+        if pos < len(s) and self._start <= s[pos] <= self._end:
+            return pos + 1
+        ctx.failed(pos, pos + 1, self)
+        return None
+
+    def _expected(self):
+        return _class_text([(self._start, self._end)], False)
 
 
 class CharSet(Expression):
-    __slots__ = ("_chars",)
+    __slots__ = ("_chars", "_negated")
 
-    def __init__(self, chars):
-        self._chars = set(chars)
+    def __init__(self, chars, negated=False):
+        self._chars = frozenset(chars)
+        self._negated = negated
 
-    def _parse(self, s, tree):
-        if s and s[0] in self._chars:
-            return tree.extend(String(s[0])), s[1:]
-        return None, s
+    def _parse(self, s, pos, tree, ctx):
+        if pos < len(s) and (s[pos] in self._chars) is not self._negated:
+            return tree.extend_span(s, pos, pos + 1), pos + 1
+        ctx.failed(pos, pos + 1, self)
+        return None, pos
 
+    def _match(self, s, pos, ctx):
+        if pos < len(s) and (s[pos] in self._chars) is not self._negated:
+            return pos + 1
+        ctx.failed(pos, pos + 1, self)
+        return None
 
-class Sequence(Expression):
-    __slots__ = ("_first", "_second")
+    def _expected(self):
+        chars = self._chars
+        if not isinstance(chars, RangeTable):
+            chars = RangeTable((c, c) for c in chars)
+        return _class_text(chars.ranges(), self._negated)
 
-    def __init__(self, first, second):
-        self._first = first
-        self._second = second
 
-    def _parse(self, s, tree):
-        res, tail = self._first._parse(s, tree)
-        if res is None:
-            return None, s
-        res, tail = self._second._parse(tail, res)
-        if res is None:
-            return None, s
-        return res, tail
+def _code(c):
+    return c if isinstance(c, int) else ord(c)
 
 
-class Choice(Expression):
-    __slots__ = ("_first", "_second")
+def _char_text(c):
+    c = chr(_code(c))
+    if c in "-]^":
+        return "\\" + c
+    return repr(c)[1:-1]
 
-    def __init__(self, first, second):
-        self._first = first
-        self._second = second
 
-    def _parse(self, s, tree):
-        res, tail = self._first._parse(s, tree)
-        if res is not None:
-            return res, tail
-        return self._second._parse(s, tree)
+def _class_text(ranges, negated):
+    return "[{}{}]".format("^" if negated else "", "".join(
+        _char_text(start) if start == end else
+        _char_text(start) + "-" + _char_text(end)
+        for start, end in ranges))
+
+
+class RangeTable:
+    __slots__ = ("_starts", "_ends")
+
+    def __init__(self, ranges):
+        self._starts = []
+        self._ends = []
+        for start, end in sorted(r for r in ranges if r[0] <= r[1]):
+            if self._ends and _code(start) <= _code(self._ends[-1]) + 1:
+                self._ends[-1] = max(self._ends[-1], end)
+            else:
+                self._starts.append(start)
+                self._ends.append(end)
+
+    def __contains__(self, c):
+        i = bisect_right(self._starts, c) - 1
+        return i >= 0 and c <= self._ends[i]
+
+    def ranges(self):
+        return list(zip(self._starts, self._ends))
+
+
+class CharClass(CharSet):
+    __slots__ = ()
+
+    MAX_SET_SIZE = 256
+
+    def __init__(self, ranges, negated=False):
+        self._chars = self.matcher(ranges)
+        self._negated = negated
+
+    @classmethod
+    def matcher(cls, ranges):
+        table = RangeTable(ranges)
+        size = sum(_code(end) - _code(start) + 1
+                   for start, end in table.ranges())
+        if size > cls.MAX_SET_SIZE:
+            return table
+        chars = set()
+        for start, end in table.ranges():
+            if isinstance(start, int):
+                chars.update(range(start, end + 1))
+            else:
+                chars.update(chr(c) for c in range(ord(start), ord(end) + 1))
+        return frozenset(chars)
+
+
+class Regex(Expression):
+    __slots__ = ("_pattern", "_re", "_name", "_expr")
+
+    def __init__(self, pattern, name=None, expr=None):
+        self._pattern = pattern
+        self._re = re.compile(pattern, re.DOTALL)
+        self._name = name
+        self._expr = expr
+
+    def _parse(self, s, pos, tree, ctx):
+        if ctx.track and self._expr is not None:
+            return self._expr._parse(s, pos, tree, ctx)
+        match = self._re.match(s, pos)
+        if match is None:
+            ctx.failed(pos, len(s) + 1, self)
+            return None, pos
+        ctx.reached(len(s) + 1)
+        end = match.end()
+        if end == pos:
+            return tree, pos
+        return tree.extend_span(s, pos, end), end
+
+    def _match(self, s, pos, ctx):
+        if ctx.track and self._expr is not None:
+            return self._expr._match(s, pos, ctx)
+        match = self._re.match(s, pos)
+        if match is None:
+            ctx.failed(pos, len(s) + 1, self)
+            return None
+        ctx.reached(len(s) + 1)
+        return match.end()
+
+    def _expected(self):
+        if self._name is not None:
+            return self._name
+        return "/{}/".format(self._pattern)
+
+
+def _cuts(expr):
+    return type(expr) is Cut or type(expr) is Sequence and \
+        any(type(item) is Cut for item in expr._items)
+
+
+def _flatten(cls, exprs):
+    items = []
+    for expr in exprs:
+        if type(expr) is cls and not (cls is Choice and
+                                      any(map(_cuts, expr._items))):
+            items.extend(expr._items)
+        else:
+            items.append(expr)
+    return tuple(items)
+
+
+class Sequence(Expression):
+    __slots__ = ("_items",)
+
+    def __init__(self, *items):
+        self._items = _flatten(Sequence, items)
+
+    def _parse(self, s, pos, tree, ctx):
+        end = pos
+        for item in self._items:
+            tree, end = item._parse(s, end, tree, ctx)
+            if tree is None:
+                return None, pos
+        return tree, end
+
+    def _match(self, s, pos, ctx):
+        end = pos
+        for item in self._items:
+            end = item._match(s, end, ctx)
+            if end is None:
+                return None
+        return end
+
+
+class Choice(Expression):
+    __slots__ = ("_items",)
+
+    def __init__(self, *alts):
+        self._items = _flatten(Choice, alts)
+
+    def _parse(self, s, pos, tree, ctx):
+        for alt in self._items:
+            res, end = alt._parse(s, pos, tree, ctx)
+            if res is not None:
+                return res, end
+            if ctx.cut:
+                ctx.cut = False
+                break
+        return None, pos
+
+    def _match(self, s, pos, ctx):
+        for alt in self._items:
+            end = alt._match(s, pos, ctx)
+            if end is not None:
+                return end
+            if ctx.cut:
+                ctx.cut = False
+                break
+        return None
+
+
+class Dispatch(Expression):
+    __slots__ = ("_items", "_table", "_default")
+
+    def __init__(self, alts, firsts):
+        self._items = tuple(alts)
+        self._default = tuple(
+            alt for alt, first in zip(alts, firsts) if first is None)
+        chars = set()
+        for first in firsts:
+            if first is not None:
+                chars.update(first)
+        self._table = {
+            c: tuple(alt for alt, first in zip(alts, firsts)
+                     if first is None or c in first)
+            for c in chars
+        }
+
+    def _alts(self, s, pos, ctx):
+        if ctx.track:
+            return self._items
+        alts = self._table.get(s[pos]) if pos < len(s) else None
+        if alts is None:
+            ctx.failed(pos, pos + 1, self)
+            return self._default
+        ctx.reached(pos + 1)
+        return alts
+
+    def _parse(self, s, pos, tree, ctx):
+        for alt in self._alts(s, pos, ctx):
+            res, end = alt._parse(s, pos, tree, ctx)
+            if res is not None:
+                return res, end
+            if ctx.cut:
+                ctx.cut = False
+                break
+        return None, pos
+
+    def _match(self, s, pos, ctx):
+        for alt in self._alts(s, pos, ctx):
+            end = alt._match(s, pos, ctx)
+            if end is not None:
+                return end
+            if ctx.cut:
+                ctx.cut = False
+                break
+        return None
+
+    def _expected(self):
+        return _class_text(RangeTable((c, c) for c in self._table).ranges(),
+                           False)
 
 
 class Repeat(Expression):
@@ -146,14 +551,28 @@ class Repeat(Expression):
     def __init__(self, expr):
         self._expr = expr
 
-    def _parse(self, s, tree):
+    def _parse(self, s, pos, tree, ctx):
+        start = pos
         while True:
-            res, tail = self._expr._parse(s, tree)
+            res, end = self._expr._parse(s, pos, tree, ctx)
             if res is None:
-                return tree, s
-            s = tail
+                if ctx.cut:
+                    ctx.cut = False
+                    return None, start
+                return tree, pos
+            pos = end
             tree = res
 
+    def _match(self, s, pos, ctx):
+        while True:
+            end = self._expr._match(s, pos, ctx)
+            if end is None:
+                if ctx.cut:
+                    ctx.cut = False
+                    return None
+                return pos
+            pos = end
+
 
 class Repeat1(Expression):
     __slots__ = ("_expr",)
@@ -161,19 +580,38 @@ class Repeat1(Expression):
     def __init__(self, expr):
         self._expr = expr
 
-    def _parse(self, s, tree):
-        res, tail = self._expr._parse(s, tree)
+    def _parse(self, s, pos, tree, ctx):
+        start = pos
+        res, end = self._expr._parse(s, pos, tree, ctx)
         if res is None:
-            return None, s
-        s = tail
+            ctx.cut = False
+            return None, pos
+        pos = end
         tree = res
         while True:
-            res, tail = self._expr._parse(s, tree)
+            res, end = self._expr._parse(s, pos, tree, ctx)
             if res is None:
-                return tree, s
-            s = tail
+                if ctx.cut:
+                    ctx.cut = False
+                    return None, start
+                return tree, pos
+            pos = end
             tree = res
 
+    def _match(self, s, pos, ctx):
+        pos = self._expr._match(s, pos, ctx)
+        if pos is None:
+            ctx.cut = False
+            return None
+        while True:
+            end = self._expr._match(s, pos, ctx)
+            if end is None:
+                if ctx.cut:
+                    ctx.cut = False
+                    return None
+                return pos
+            pos = end
+
 
 class Optional(Expression):
     __slots__ = ("_expr",)
@@ -181,11 +619,23 @@ class Optional(Expression):
     def __init__(self, expr):
         self._expr = expr
 
-    def _parse(self, s, tree):
-        res, tail = self._expr._parse(s, tree)
+    def _parse(self, s, pos, tree, ctx):
+        res, end = self._expr._parse(s, pos, tree, ctx)
         if res is None:
-            return tree, s
-        return res, tail
+            if ctx.cut:
+                ctx.cut = False
+                return None, pos
+            return tree, pos
+        return res, end
+
+    def _match(self, s, pos, ctx):
+        end = self._expr._match(s, pos, ctx)
+        if end is None:
+            if ctx.cut:
+                ctx.cut = False
+                return None
+            return pos
+        return end
 
 
 class And(Expression):
@@ -194,11 +644,19 @@ class And(Expression):
     def __init__(self, expr):
         self._expr = expr
 
-    def _parse(self, s, tree):
-        res, _ = self._expr._parse(s, Empty())
+    def _parse(self, s, pos, tree, ctx):
+        res, end = self._expr._parse(s, pos, EMPTY, ctx)
         if res is not None:
-            return tree, s
-        return None, s
+            ctx.reached(end)
+            return tree, pos
+        return None, pos
+
+    def _match(self, s, pos, ctx):
+        end = self._expr._match(s, pos, ctx)
+        if end is not None:
+            ctx.reached(end)
+            return pos
+        return None
 
 
 class Not(Expression):
@@ -207,11 +665,28 @@ class Not(Expression):
     def __init__(self, expr):
         self._expr = expr
 
-    def _parse(self, s, tree):
-        res, _ = self._expr._parse(s, Empty())
+    def _parse(self, s, pos, tree, ctx):
+        fail, expected = ctx.fail, ctx.expected
+        res, end = self._expr._parse(s, pos, EMPTY, ctx)
+        ctx.fail, ctx.expected = fail, expected
         if res is None:
-            return tree, s
-        return None, s
+            return tree, pos
+        ctx.failed(pos, end, self)
+        return None, pos
+
+    def _match(self, s, pos, ctx):
+        fail, expected = ctx.fail, ctx.expected
+        end = self._expr._match(s, pos, ctx)
+        ctx.fail, ctx.expected = fail, expected
+        if end is None:
+            return pos
+        ctx.failed(pos, end, self)
+        return None
+
+    def _expected(self):
+        if isinstance(self._expr, Any):
+            return "end of input"
+        return None
 
 
 class Ignore(Expression):
@@ -220,11 +695,14 @@ class Ignore(Expression):
     def __init__(self, expr):
         self._expr = expr
 
-    def _parse(self, s, tree):
-        res, tail = self._expr._parse(s, Empty())
+    def _parse(self, s, pos, tree, ctx):
+        res, end = self._expr._parse(s, pos, EMPTY, ctx)
         if res is None:
-            return None, s
-        return tree, tail
+            return None, pos
+        return tree, end
+
+    def _match(self, s, pos, ctx):
+        return self._expr._match(s, pos, ctx)
 
 
 class Append(Expression):
@@ -234,11 +712,14 @@ class Append(Expression):
         self._expr = expr
         self._name = name
 
-    def _parse(self, s, tree):
-        res, tail = self._expr._parse(s, Empty())
+    def _parse(self, s, pos, tree, ctx):
+        res, end = self._expr._parse(s, pos, EMPTY, ctx)
         if res is None:
-            return None, s
-        return tree.append(self._name, res), tail
+            return None, pos
+        return tree.append(self._name, res), end
+
+    def _match(self, s, pos, ctx):
+        return self._expr._match(s, pos, ctx)
 
 
 class Extend(Expression):
@@ -247,11 +728,14 @@ class Extend(Expression):
     def __init__(self, expr):
         self._expr = expr
 
-    def _parse(self, s, tree):
-        res, tail = self._expr._parse(s, Empty())
+    def _parse(self, s, pos, tree, ctx):
+        res, end = self._expr._parse(s, pos, EMPTY, ctx)
         if res is None:
-            return None, s
-        return tree.extend(res), tail
+            return None, pos
+        return tree.extend(res), end
+
+    def _match(self, s, pos, ctx):
+        return self._expr._match(s, pos, ctx)
 
 
 class Rappend(Expression):
@@ -261,11 +745,14 @@ class Rappend(Expression):
         self._expr = expr
         self._name = name
 
-    def _parse(self, s, tree):
-        res, tail = self._expr._parse(s, Empty())
+    def _parse(self, s, pos, tree, ctx):
+        res, end = self._expr._parse(s, pos, EMPTY, ctx)
         if res is None:
-            return None, s
-        return res.rappend(self._name, tree), tail
+            return None, pos
+        return res.rappend(self._name, tree), end
+
+    def _match(self, s, pos, ctx):
+        return self._expr._match(s, pos, ctx)
 
 
 class Rextend(Expression):
@@ -274,11 +761,14 @@ class Rextend(Expression):
     def __init__(self, expr):
         self._expr = expr
 
-    def _parse(self, s, tree):
-        res, tail = self._expr._parse(s, Empty())
+    def _parse(self, s, pos, tree, ctx):
+        res, end = self._expr._parse(s, pos, EMPTY, ctx)
         if res is None:
-            return None, s
-        return res.rextend(tree), tail
+            return None, pos
+        return res.rextend(tree), end
+
+    def _match(self, s, pos, ctx):
+        return self._expr._match(s, pos, ctx)
 
 
 class Tag(Expression):
@@ -287,27 +777,333 @@ class Tag(Expression):
     def __init__(self, name):
         self._name = name
 
-    def _parse(self, s, tree):
-        return Named(self._name), s
+    def _parse(self, s, pos, tree, ctx):
+        return Named(self._name), pos
+
+    def _match(self, s, pos, ctx):
+        return pos
+
+
+class Cut(Expression):
+    __slots__ = ("_expr",)
+
+    def __init__(self, expr):
+        self._expr = expr
+
+    def _parse(self, s, pos, tree, ctx):
+        ctx.commit(pos)
+        res, end = self._expr._parse(s, pos, tree, ctx)
+        if res is None:
+            ctx.cut = True
+        return res, end
+
+    def _match(self, s, pos, ctx):
+        ctx.commit(pos)
+        end = self._expr._match(s, pos, ctx)
+        if end is None:
+            ctx.cut = True
+        return end
+
+
+class Checkpoint(Expression):
+    __slots__ = ("_expr",)
+
+    def __init__(self, expr):
+        self._expr = expr
+
+    def _parse(self, s, pos, tree, ctx):
+        marks = ctx.marks
+        marks.append(pos)
+        res, end = self._expr._parse(s, pos, tree, ctx)
+        marks.pop()
+        return res, end
+
+    def _match(self, s, pos, ctx):
+        marks = ctx.marks
+        marks.append(pos)
+        end = self._expr._match(s, pos, ctx)
+        marks.pop()
+        return end
+
+
+class Memo(Expression):
+    __slots__ = ("_expr", "_stats")
+
+    def __init__(self, expr, stats):
+        self._expr = expr
+        self._stats = stats
+
+    def _parse(self, s, pos, tree, ctx):
+        if tree is not EMPTY:
+            return self._expr._parse(s, pos, tree, ctx)
+        key = (self, pos)
+        memo = ctx.memo
+        entry = memo.get(key)
+        if entry is not None:
+            self._stats[0] += 1
+            res, end, reach, fail, expected = entry
+            ctx.reached(reach)
+            if fail >= ctx.fail:
+                ctx.failures(fail, expected)
+            if res is None:
+                return None, pos
+            return res.fork(), end
+        self._stats[1] += 1
+        outer, fail, expected = ctx.reach, ctx.fail, ctx.expected
+        ctx.reach, ctx.fail, ctx.expected = pos, -1, []
+        res, end = self._expr._parse(s, pos, tree, ctx)
+        reach = ctx.reach
+        if res is not None and end > reach:
+            reach = end
+        memo[key] = res, end, reach, ctx.fail, ctx.expected
+        ctx.reach = max(outer, reach)
+        inner = ctx.fail, ctx.expected
+        ctx.fail, ctx.expected = fail, expected
+        ctx.failures(*inner)
+        return res, end
+
+    def _match(self, s, pos, ctx):
+        key = (self, pos)
+        memo = ctx.memo
+        entry = memo.get(key)
+        if entry is not None:
+            self._stats[0] += 1
+            end, reach = entry
+            ctx.reached(reach)
+            return end
+        self._stats[1] += 1
+        outer = ctx.reach
+        ctx.reach = pos
+        end = self._expr._match(s, pos, ctx)
+        reach = ctx.reach
+        if end is not None and end > reach:
+            reach = end
+        memo[key] = end, reach
+        ctx.reach = max(outer, reach)
+        return end
+
+
+class Profile(Expression):
+    __slots__ = ("_expr", "_stats", "_stack")
+
+    def __init__(self, expr, stats, stack):
+        self._expr = expr
+        self._stats = stats
+        self._stack = stack
+
+    def _enter(self, pos, ctx):
+        stats = self._stats
+        stats[0] += 1
+        stats[6] += 1
+        self._stack.append([0.0, ctx.reach])
+        ctx.reach = pos
+        return perf_counter()
+
+    def _leave(self, pos, end, start, ctx):
+        elapsed = perf_counter() - start
+        stats = self._stats
+        stack = self._stack
+        child, outer = stack.pop()
+        stats[6] -= 1
+        if not stats[6]:
+            stats[3] += elapsed
+        stats[4] += elapsed - child
+        reach = ctx.reach
+        if end is None:
+            stats[2] += 1
+            if reach > pos + 1:
+                stats[5] += reach - pos - 1
+        else:
+            stats[1] += 1
+        if outer > reach:
+            ctx.reach = outer
+        if stack:
+            stack[-1][0] += elapsed
+
+    def _parse(self, s, pos, tree, ctx):
+        start = self._enter(pos, ctx)
+        res, end = self._expr._parse(s, pos, tree, ctx)
+        self._leave(pos, None if res is None else end, start, ctx)
+        return res, end
+
+    def _match(self, s, pos, ctx):
+        start = self._enter(pos, ctx)
+        end = self._expr._match(s, pos, ctx)
+        self._leave(pos, end, start, ctx)
+        return end
+
+
+def _link(value, resolve):
+    if isinstance(value, Expression):
+        return resolve(value)
+    if isinstance(value, tuple):
+        return tuple(_link(item, resolve) for item in value)
+    if isinstance(value, dict):
+        return {key: _link(item, resolve) for key, item in value.items()}
+    return value
+
+
+def _slots(expr):
+    for cls in type(expr).__mro__:
+        for name in cls.__dict__.get("__slots__", ()):
+            yield name
 
 
 class Grammar(object):
 
-    def __init__(self):
+    def __init__(self, memoize=False, profile=False):
         self._rules = {}
-
-    def __call__(self, name, body=None):
+        self._memoize = memoize
+        self._stats = {}
+        self._profile = {} if profile else None
+        self._stack = []
+        self._frozen = False
+        self._source = None
+
+    def __reduce__(self):
+        return Grammar, (self._memoize,), {
+            "rules": self._rules if self._source is None else self._source,
+            "stats": self._stats,
+            "profile": self._profile,
+            "stack": self._stack,
+            "frozen": self._frozen,
+        }
+
+    def __setstate__(self, state):
+        self._rules.update(state["rules"])
+        self._stats = state["stats"]
+        self._profile = state["profile"]
+        self._stack = state["stack"]
+        if state["frozen"]:
+            self.freeze()
+
+    def __call__(self, name, body=None, memoize=None):
+        if self._frozen:
+            if body is not None:
+                raise ValueError("Rule {} redefined after freeze".format(name))
+            if name not in self._rules:
+                raise ValueError("Rule {} undefined".format(name))
         if body is not None:
+            if memoize is None:
+                memoize = self._memoize
+            if memoize:
+                stats = self._stats.setdefault(name, [0, 0])
+                body = Memo(body, stats)
+            if self._profile is not None:
+                stats = self._profile.setdefault(name, [0, 0, 0, 0.0, 0.0,
+                                                        0, 0])
+                body = Profile(body, stats, self._stack)
             self._rules[name] = body
-        return Rule(name, lambda: self._rules[name])
+        return Rule(name, self)
+
+    @property
+    def frozen(self):
+        return self._frozen
+
+    @property
+    def memoize(self):
+        return self._memoize
+
+    def freeze(self):
+        if self._frozen:
+            return self
+        undefined = set()
+
+        def resolve(rule):
+            seen = set()
+            expr = rule
+            while isinstance(expr, Rule):
+                if expr._name not in expr._rules:
+                    undefined.add(expr._name)
+                    return rule
+                if expr in seen:
+                    raise ValueError(
+                        "Rule {} is not well-formed".format(expr._name))
+                seen.add(expr)
+                expr = expr._rules[expr._name]
+            return expr
+
+        copies = {}
+        stack = []
+
+        def link(expr):
+            if isinstance(expr, Rule):
+                expr = resolve(expr)
+                if isinstance(expr, Rule):
+                    return expr
+            if expr not in copies:
+                copies[expr] = copy(expr)
+                stack.append(expr)
+            return copies[expr]
+
+        rules = {name: link(body) for name, body in self._rules.items()}
+        while stack:
+            expr = stack.pop()
+            for slot in _slots(expr):
+                value = getattr(expr, slot)
+                linked = _link(value, link)
+                if linked is not value:
+                    setattr(copies[expr], slot, linked)
+        if undefined:
+            raise ValueError(
+                "Rules {} undefined".format(", ".join(sorted(undefined))))
+        self._source = dict(self._rules)
+        self._rules.update(rules)
+        self._frozen = True
+        return self
+
+    def memo_stats(self):
+        return {name: tuple(stats) for name, stats in self._stats.items()}
+
+    def reset_stats(self):
+        for stats in self._stats.values():
+            stats[0] = stats[1] = 0
+        if self._profile is not None:
+            for stats in self._profile.values():
+                stats[:] = [0, 0, 0, 0.0, 0.0, 0, 0]
+            del self._stack[:]
+
+    def profile_stats(self):
+        if self._profile is None:
+            raise ValueError("Grammar is not profiled")
+        return {name: tuple(stats[:6])
+                for name, stats in self._profile.items()}
+
+    def report(self, sort="self", limit=None):
+        columns = ("calls", "successes", "failures", "cumulative", "self",
+                   "backtracked")
+        key = columns.index(sort)
+        rows = sorted(self.profile_stats().items(),
+                      key=lambda item: item[1][key], reverse=True)
+        if limit is not None:
+            rows = rows[:limit]
+        width = max([len("rule")] + [len(name) for name, _ in rows])
+        lines = ["{:<{}} {:>9} {:>9} {:>9} {:>11} {:>11} {:>11}".format(
+            "rule", width, *columns)]
+        for name, (calls, ok, failed, total, own, lost) in rows:
+            lines.append(
+                "{:<{}} {:>9} {:>9} {:>9} {:>11.6f} {:>11.6f} {:>11}".format(
+                    name, width, calls, ok, failed, total, own, lost))
+        return "\n".join(lines)
 
 
 class Rule(Expression):
-    __slots__ = ("_name", "_lazy")
+    __slots__ = ("_name", "_rules", "_grammar")
 
-    def __init__(self, name, lazy):
+    def __init__(self, name, grammar):
         self._name = name
-        self._lazy = lazy
+        self._rules = grammar._rules
+        self._grammar = grammar
+
+    def __reduce__(self):
+        return Rule, (self._name, self._grammar)
+
+    @property
+    def grammar(self):
+        return self._grammar
+
+    def _parse(self, s, pos, tree, ctx):
+        return self._rules[self._name]._parse(s, pos, tree, ctx)
 
-    def _parse(self, s, tree):
-        return self._lazy()._parse(s, tree)
+    def _match(self, s, pos, ctx):
+        return self._rules[self._name]._match(s, pos, ctx)
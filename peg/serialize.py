@@ -0,0 +1,31 @@
+import struct
+
+
+__all__ = ("FORMAT_VERSION", "dump_parser", "load_parser")
+
+
+MAGIC = b"PEG\0"
+FORMAT_VERSION = 5
+
+_HEADER = struct.Struct("<4sH")
+
+
+def dump_parser(parser):
+    import pickle
+    import zlib
+    payload = pickle.dumps(parser, pickle.HIGHEST_PROTOCOL)
+    return _HEADER.pack(MAGIC, FORMAT_VERSION) + zlib.compress(payload, 9)
+
+
+def load_parser(data):
+    import pickle
+    import zlib
+    if len(data) < _HEADER.size:
+        raise ValueError("Truncated parser data")
+    magic, version = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a serialized parser")
+    if version != FORMAT_VERSION:
+        raise ValueError(
+            "Unsupported parser format version {}".format(version))
+    return pickle.loads(zlib.decompress(data[_HEADER.size:]))
@@ -0,0 +1,59 @@
+from .peg import Context
+from .tree import EMPTY
+
+
+__all__ = ("parse_iter",)
+
+
+def _context():
+    ctx = Context()
+    ctx.track = True
+    return ctx
+
+
+def parse_iter(fileobj, item, separator=None, chunk_size=1 << 16):
+    buf = fileobj.read(chunk_size)
+    offset = 0
+    pos = 0
+    eof = not buf
+    more = False
+    first = True
+    while True:
+        if not eof and (more or len(buf) - pos < chunk_size):
+            chunk = fileobj.read(max(chunk_size, len(buf) - pos))
+            if chunk:
+                offset += pos
+                buf = buf[pos:] + chunk
+                pos = 0
+            else:
+                eof = True
+            more = False
+            continue
+        start = pos
+        if not first and separator is not None:
+            ctx = _context()
+            start = separator._match(buf, pos, ctx)
+            if not eof and ctx.reach > len(buf):
+                more = True
+                continue
+            if start is None:
+                if eof and pos == len(buf):
+                    return
+                raise ValueError(
+                    "Separator expected at offset {}".format(offset + pos))
+        if eof and start == len(buf):
+            return
+        ctx = _context()
+        res, end = item._parse(buf, start, EMPTY, ctx)
+        if not eof and ctx.reach > len(buf):
+            more = True
+            continue
+        if res is None:
+            raise ValueError(
+                "Item expected at offset {}".format(offset + start))
+        if end == start:
+            raise ValueError(
+                "Item at offset {} consumed no input".format(offset + start))
+        yield res.finalize()
+        pos = end
+        first = False
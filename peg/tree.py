@@ -1,58 +1,134 @@
-__all__ = ("Empty", "Named", "FinalizedNamed", "String", "Term",
-           "FinalizedTerm", "Container", "Node", "FinalizedNode")
+__all__ = ("Empty", "EMPTY", "Void", "VOID", "Named", "FinalizedNamed",
+           "String", "Term", "FinalizedTerm", "Container", "Node",
+           "FinalizedNode")
+
+
+def _push(items, length, new):
+    if len(items) != length:
+        del items[length:]
+    items.extend(new)
+    return len(items)
+
+
+def _text(source, spans, length):
+    start, end = spans[0], spans[1]
+    if length == 2:
+        return source[start:end]
+    parts = []
+    for i in range(2, length, 2):
+        if spans[i] != end:
+            parts.append(source[start:end])
+            start = spans[i]
+        end = spans[i + 1]
+    parts.append(source[start:end])
+    if isinstance(source, str):
+        return "".join(parts)
+    text = b"".join(parts)
+    if type(parts[0]) is bytes:
+        return text
+    return type(parts[0])(text)
 
 
 class Empty:
     __slots__ = ()
 
+    def fork(self):
+        return self
+
+    def relocate(self, source, delta):
+        return self
+
     def append(self, name, other):
-        return Container([(name, other.finalize())])
+        return Container([(name, other.finalize())], 1)
 
     def extend(self, other):
         if isinstance(other, (String, Term)):
-            return String(other._value)
+            return String(other._source, other._spans, other._len)
         if isinstance(other, (Container, Node)):
-            return Container(other._values)
+            return Container(other._values, other._len)
         return self
 
+    def extend_span(self, source, start, end):
+        return String(source, [start, end], 2)
+
     def rappend(self, name, other):
-        return Container([(name, other.finalize())])
+        return Container([(name, other.finalize())], 1)
 
     def rextend(self, other):
         if isinstance(other, (String, Term)):
-            return String(other._value)
+            return String(other._source, other._spans, other._len)
         if isinstance(other, (Container, Node)):
-            return Container(other._values)
+            return Container(other._values, other._len)
+        return self
+
+
+EMPTY = Empty()
+
+
+class Void:
+    __slots__ = ()
+
+    def fork(self):
+        return self
+
+    def relocate(self, source, delta):
+        return self
+
+    def append(self, name, other):
+        return self
+
+    def extend(self, other):
+        return self
+
+    def extend_span(self, source, start, end):
+        return self
+
+    def rappend(self, name, other):
+        return self
+
+    def rextend(self, other):
         return self
 
 
+VOID = Void()
+
+
 class Named:
     __slots__ = ("_name",)
 
     def __init__(self, name):
         self._name = name
 
+    def fork(self):
+        return self
+
+    def relocate(self, source, delta):
+        return self
+
     def finalize(self):
         return FinalizedNamed(self._name)
 
     def append(self, name, other):
-        return Node(self._name, [(name, other.finalize())])
+        return Node(self._name, [(name, other.finalize())], 1)
 
     def extend(self, other):
         if isinstance(other, (String, Term)):
-            return Term(self._name, other._value)
+            return Term(self._name, other._source, other._spans, other._len)
         if isinstance(other, (Container, Node)):
-            return Node(self._name, other._values)
+            return Node(self._name, other._values, other._len)
         return self
 
+    def extend_span(self, source, start, end):
+        return Term(self._name, source, [start, end], 2)
+
     def rappend(self, name, other):
-        return Node(self._name, [(name, other.finalize())])
+        return Node(self._name, [(name, other.finalize())], 1)
 
     def rextend(self, other):
         if isinstance(other, (String, Term)):
-            return Term(self._name, other._value)
+            return Term(self._name, other._source, other._spans, other._len)
         if isinstance(other, (Container, Node)):
-            return Node(self._name, other._values)
+            return Node(self._name, other._values, other._len)
         return self
 
 
@@ -77,45 +153,79 @@ class FinalizedNamed:
 
 
 class String:
-    __slots__ = ("_value",)
+    __slots__ = ("_source", "_spans", "_len")
 
-    def __init__(self, value):
-        self._value = value
+    def __init__(self, source, spans, length):
+        self._source = source
+        self._spans = spans
+        self._len = length
+
+    def fork(self):
+        return String(self._source, self._spans[:self._len], self._len)
+
+    def relocate(self, source, delta):
+        spans = [i + delta for i in self._spans[:self._len]]
+        return String(source, spans, self._len)
 
     def append(self, name, other):
         raise TypeError()
 
     def extend(self, other):
-        return String(self._value + other._value)
+        spans = other._spans[:other._len]
+        return String(self._source, self._spans,
+                      _push(self._spans, self._len, spans))
+
+    def extend_span(self, source, start, end):
+        return String(source, self._spans,
+                      _push(self._spans, self._len, (start, end)))
 
     def rappend(self, name, other):
         raise TypeError()
 
     def rextend(self, other):
-        return String(other._value + self._value)
+        spans = other._spans[:other._len] + self._spans[:self._len]
+        return String(self._source, spans, len(spans))
 
 
 class Term:
-    __slots__ = ("_name", "_value")
+    __slots__ = ("_name", "_source", "_spans", "_len")
 
-    def __init__(self, name, value):
+    def __init__(self, name, source, spans, length):
         self._name = name
-        self._value = value
+        self._source = source
+        self._spans = spans
+        self._len = length
+
+    def fork(self):
+        return Term(self._name, self._source, self._spans[:self._len],
+                    self._len)
+
+    def relocate(self, source, delta):
+        spans = [i + delta for i in self._spans[:self._len]]
+        return Term(self._name, source, spans, self._len)
 
     def finalize(self):
-        return FinalizedTerm(self._name, self._value)
+        return FinalizedTerm(self._name,
+                             _text(self._source, self._spans, self._len))
 
     def append(self, name, other):
         raise TypeError()
 
     def extend(self, other):
-        return Term(self._name, self._value + other._value)
+        spans = other._spans[:other._len]
+        return Term(self._name, self._source, self._spans,
+                    _push(self._spans, self._len, spans))
+
+    def extend_span(self, source, start, end):
+        return Term(self._name, source, self._spans,
+                    _push(self._spans, self._len, (start, end)))
 
     def rappend(self, name, other):
         raise TypeError()
 
     def rextend(self, other):
-        return Term(self._name, other._value + self._value)
+        spans = other._spans[:other._len] + self._spans[:self._len]
+        return Term(self._name, self._source, spans, len(spans))
 
 
 class FinalizedTerm:
@@ -145,59 +255,93 @@ class FinalizedTerm:
 
 
 class Container:
-    __slots__ = ("_values",)
+    __slots__ = ("_values", "_len")
 
-    def __init__(self, values):
+    def __init__(self, values, length):
         self._values = values
+        self._len = length
+
+    def fork(self):
+        return Container(self._values[:self._len], self._len)
+
+    def relocate(self, source, delta):
+        return self
 
     def append(self, name, other):
-        return Container(self._values + [(name, other.finalize())])
+        item = (name, other.finalize())
+        return Container(self._values,
+                         _push(self._values, self._len, (item,)))
 
     def extend(self, other):
-        return Container(self._values + other._values)
+        values = other._values[:other._len]
+        return Container(self._values,
+                         _push(self._values, self._len, values))
+
+    def extend_span(self, source, start, end):
+        return self.extend(String(source, [start, end], 2))
 
     def rappend(self, name, other):
-        return Container([(name, other.finalize())] + self._values)
+        values = [(name, other.finalize())] + self._values[:self._len]
+        return Container(values, len(values))
 
     def rextend(self, other):
-        return Container(other._values + self._values)
+        values = other._values[:other._len] + self._values[:self._len]
+        return Container(values, len(values))
 
 
 class Node:
-    __slots__ = ("_name", "_values")
+    __slots__ = ("_name", "_values", "_len")
 
-    def __init__(self, name, values):
+    def __init__(self, name, values, length):
         self._name = name
         self._values = values
+        self._len = length
+
+    def fork(self):
+        return Node(self._name, self._values[:self._len], self._len)
+
+    def relocate(self, source, delta):
+        return self
 
     def finalize(self):
-        return FinalizedNode(self._name, self._values)
+        return FinalizedNode(self._name, self._values[:self._len])
 
     def append(self, name, other):
-        return Node(self._name, self._values + [(name, other.finalize())])
+        item = (name, other.finalize())
+        return Node(self._name, self._values,
+                    _push(self._values, self._len, (item,)))
 
     def extend(self, other):
-        return Node(self._name, self._values + other._values)
+        values = other._values[:other._len]
+        return Node(self._name, self._values,
+                    _push(self._values, self._len, values))
+
+    def extend_span(self, source, start, end):
+        return self.extend(String(source, [start, end], 2))
 
     def rappend(self, name, other):
-        return Node(self._name, [(name, other.finalize())] + self._values)
+        values = [(name, other.finalize())] + self._values[:self._len]
+        return Node(self._name, values, len(values))
 
     def rextend(self, other):
-        return Node(self._name, other._values + self._values)
+        values = other._values[:other._len] + self._values[:self._len]
+        return Node(self._name, values, len(values))
 
 
 class FinalizedNode:
-    __slots__ = ("_name", "_values", "_values_dict", "_single_values")
+    __slots__ = ("_name", "_values", "_values_dict")
 
     def __init__(self, name, values):
         self._name = name
         self._values = values
-        self._values_dict = {}
-        for n, v in values:
-            self._values_dict.setdefault(n, []).append(v)
-        self._single_values = {
-            n: vs[0] for n, vs in self._values_dict.items() if len(vs) == 1
-        }
+        self._values_dict = None
+
+    def _index(self):
+        if self._values_dict is None:
+            self._values_dict = {}
+            for n, v in self._values:
+                self._values_dict.setdefault(n, []).append(v)
+        return self._values_dict
 
     def __str__(self):
         if len(self._values) == 0:
@@ -219,7 +363,10 @@ class FinalizedNode:
         return self._name
 
     def values(self, item):
-        return self._values_dict[item]
+        return self._index()[item]
 
     def __getitem__(self, item):
-        return self._single_values[item]
+        values = self._index()[item]
+        if len(values) != 1:
+            raise KeyError(item)
+        return values[0]
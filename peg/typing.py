@@ -652,6 +652,9 @@ class TypingVisitor(Visitor):
     def visit_Not(self, node):
         return NoOp()
 
+    def visit_Cut(self, node):
+        return NoOp()
+
 
 def infer_types(grammar):
     visitor = TypingVisitor()
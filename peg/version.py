@@ -0,0 +1,4 @@
+__all__ = ("__version__",)
+
+
+__version__ = "0.1.dev0"
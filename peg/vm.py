@@ -0,0 +1,466 @@
+import re
+
+from .visitor import Visitor
+from .generate import (class_ranges, literal_run, merged_literal,
+                       negated_class)
+from .peg import CharClass, RangeTable, _class_text, _error
+from .tree import *
+
+
+__all__ = ("Machine", "MachineCompiler", "compile_machine")
+
+
+(ANY, LITERAL, RANGE, SET, REGEX, SKIP, FAIL, TAG, CHOICE, COMMIT,
+ PREDICATE, BACK_COMMIT, FAIL_TWICE, CALL, RET, JUMP, BEGIN, APPEND,
+ EXTEND, RAPPEND, REXTEND, IGNORE, END, CUT, MUTE) = range(25)
+
+OPCODES = (
+    "ANY", "LITERAL", "RANGE", "SET", "REGEX", "SKIP", "FAIL", "TAG",
+    "CHOICE", "COMMIT", "PREDICATE", "BACK_COMMIT", "FAIL_TWICE", "CALL",
+    "RET", "JUMP", "BEGIN", "APPEND", "EXTEND", "RAPPEND", "REXTEND",
+    "IGNORE", "END", "CUT", "MUTE"
+)
+
+_BACKTRACK, _RETURN, _TREE, _COMMITTED = range(4)
+
+
+def _failed(errors, pos, op):
+    if errors[2]:
+        return
+    if pos > errors[0]:
+        errors[0] = pos
+        errors[1] = [op]
+    elif pos == errors[0] and op not in errors[1]:
+        errors[1] = errors[1] + [op]
+
+
+def _expected(op, a, b):
+    if op == LITERAL:
+        return repr(a)
+    if op == SET:
+        if not isinstance(a, RangeTable):
+            a = RangeTable((c, c) for c in a)
+        return _class_text(a.ranges(), b)
+    if op == RANGE:
+        return _class_text([(a, b)], False)
+    if op == ANY:
+        return "any character"
+    return a
+
+
+class Label:
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return "<{}>".format(self.name)
+
+
+class Machine:
+    __slots__ = ("_code", "_recognizer", "_checker")
+
+    def __init__(self, code, recognizer, checker):
+        self._code = code
+        self._recognizer = recognizer
+        self._checker = checker
+
+    def dump(self, recognizer=False):
+        lines = []
+        code = self._recognizer if recognizer else self._code
+        for addr, (op, a, b) in enumerate(code):
+            args = [repr(arg) for arg in (a, b) if arg is not None]
+            lines.append("{:5} {} {}".format(addr, OPCODES[op],
+                                             ", ".join(args)).rstrip())
+        return "\n".join(lines)
+
+    def parse(self, s, pos=0):
+        res, end = self._run(self._code, s, pos, EMPTY)
+        if res is None:
+            return None, pos
+        return res.finalize(), end
+
+    def match(self, s, pos=0):
+        res, end = self._run(self._recognizer, s, pos, VOID)
+        if res is None:
+            return False, pos
+        return True, end
+
+    def parse_strict(self, s, pos=0):
+        errors = [-1, [], 0]
+        res, end = self._run(self._checker, s, pos, EMPTY, errors)
+        expected = [_expected(*op) for op in errors[1]]
+        if res is None:
+            raise _error(s, pos, None, errors[0], expected)
+        if end != len(s):
+            raise _error(s, pos, end, errors[0], expected)
+        return res.finalize()
+
+    def _run(self, code, s, pos, empty, errors=None):
+        stack = []
+        length = len(s)
+        tree = empty
+        pc = 0
+        while True:
+            op, a, b = code[pc]
+            if op == CALL:
+                stack.append((_RETURN, pc + 1))
+                pc = a
+                continue
+            elif op == RET:
+                pc = stack.pop()[1]
+                continue
+            elif op == LITERAL:
+                if s.startswith(a, pos):
+                    tree = tree.extend_span(s, pos, pos + b)
+                    pos += b
+                    pc += 1
+                    continue
+            elif op == SET:
+                if pos < length and (s[pos] in a) is not b:
+                    tree = tree.extend_span(s, pos, pos + 1)
+                    pos += 1
+                    pc += 1
+                    continue
+            elif op == RANGE:
+                if pos < length and a <= s[pos] <= b:
+                    tree = tree.extend_span(s, pos, pos + 1)
+                    pos += 1
+                    pc += 1
+                    continue
+            elif op == REGEX:
+                match = a.match(s, pos)
+                if match is not None:
+                    end = match.end()
+                    if end != pos:
+                        tree = tree.extend_span(s, pos, end)
+                        pos = end
+                    pc += 1
+                    continue
+            elif op == SKIP:
+                match = a.match(s, pos)
+                if match is not None:
+                    pos = match.end()
+                    pc += 1
+                    continue
+            elif op == ANY:
+                if pos < length:
+                    tree = tree.extend_span(s, pos, pos + 1)
+                    pos += 1
+                    pc += 1
+                    continue
+            elif op == CHOICE:
+                stack.append((_BACKTRACK, a, pos, tree))
+                pc += 1
+                continue
+            elif op == COMMIT:
+                stack.pop()
+                pc = a
+                continue
+            elif op == JUMP:
+                pc = a
+                continue
+            elif op == BEGIN:
+                stack.append((_TREE, tree))
+                tree = empty
+                pc += 1
+                continue
+            elif op == APPEND:
+                tree = stack.pop()[1].append(a, tree)
+                pc += 1
+                continue
+            elif op == RAPPEND:
+                tree = tree.rappend(a, stack.pop()[1])
+                pc += 1
+                continue
+            elif op == EXTEND:
+                tree = stack.pop()[1].extend(tree)
+                pc += 1
+                continue
+            elif op == REXTEND:
+                tree = tree.rextend(stack.pop()[1])
+                pc += 1
+                continue
+            elif op == IGNORE:
+                tree = stack.pop()[1]
+                pc += 1
+                continue
+            elif op == TAG:
+                tree = Named(a)
+                pc += 1
+                continue
+            elif op == PREDICATE:
+                stack.append((_BACKTRACK, a, pos, tree))
+                tree = empty
+                pc += 1
+                continue
+            elif op == BACK_COMMIT:
+                _, _, pos, tree = stack.pop()
+                pc = a
+                continue
+            elif op == CUT:
+                for i in range(len(stack) - 1, -1, -1):
+                    if stack[i][0] == _BACKTRACK:
+                        stack[i] = (_COMMITTED,)
+                        break
+                pc += 1
+                continue
+            elif op == FAIL_TWICE:
+                pos = stack.pop()[2]
+            elif op == END:
+                return tree, pos
+            elif op == MUTE:
+                errors[2] += a
+                pc += 1
+                continue
+            if errors is not None and op != FAIL:
+                _failed(errors, pos, code[pc])
+            while stack:
+                frame = stack.pop()
+                if frame[0] == _BACKTRACK:
+                    _, pc, pos, tree = frame
+                    break
+            else:
+                return None, pos
+
+
+class MachineCompiler(Visitor):
+    def __init__(self, recognize=False, check=False):
+        self._code = []
+        self._rules = {}
+        self._subroutines = []
+        self._recognize = recognize
+        self._check = check
+
+    def _label(self, name="L"):
+        return Label(name)
+
+    def _emit(self, op, a=None, b=None):
+        self._code.append((op, a, b))
+
+    def _mark(self, label):
+        self._code.append(label)
+
+    def _rule(self, name):
+        if name not in self._rules:
+            self._rules[name] = self._label(name)
+        return self._rules[name]
+
+    def _link(self):
+        addrs = {}
+        code = []
+        for item in self._code:
+            if isinstance(item, Label):
+                addrs[item] = len(code)
+            else:
+                code.append(item)
+        return [
+            (op, addrs[a] if isinstance(a, Label) else a, b)
+            for op, a, b in code
+        ]
+
+    def visit_Grammar(self, node):
+        rules = node.values("rule")
+        self._emit(CALL, self._rule(rules[0]["name"].value))
+        self._emit(END)
+        for rule in rules:
+            self.visit(rule)
+        while self._subroutines:
+            label, body = self._subroutines.pop()
+            self._mark(label)
+            self._code.extend(body)
+            self._emit(RET)
+        return self._link()
+
+    def visit_Rule(self, node):
+        self._mark(self._rule(node["name"].value))
+        self.visit(node["body"])
+        self._emit(RET)
+
+    def visit_Sequence(self, node):
+        items = node.values("item")
+        i = 0
+        while i < len(items):
+            negated = negated_class(items, i)
+            run = None if self._check else literal_run(items, i)
+            if negated is not None:
+                self._emit(SET, CharClass.matcher(class_ranges(self, negated)),
+                           True)
+                i += 2
+            elif run is not None:
+                self.visit(merged_literal(*run))
+                i += len(run[1])
+            else:
+                self.visit(items[i])
+                i += 1
+
+    def visit_Choice(self, node):
+        alts = node.values("alt")
+        end = self._label()
+        for alt in alts[:-1]:
+            nxt = self._label()
+            self._emit(CHOICE, nxt)
+            self.visit(alt)
+            self._emit(COMMIT, end)
+            self._mark(nxt)
+        self.visit(alts[-1])
+        self._mark(end)
+
+    def visit_Epsilon(self, node):
+        pass
+
+    def visit_Nothing(self, node):
+        self._emit(FAIL)
+
+    def visit_Cut(self, node):
+        self._emit(CUT)
+
+    def visit_And(self, node):
+        fail, end = self._label(), self._label()
+        self._emit(PREDICATE, fail)
+        self.visit(node["expr"])
+        self._emit(BACK_COMMIT, end)
+        self._mark(fail)
+        self._emit(FAIL)
+        self._mark(end)
+
+    def visit_Not(self, node):
+        end = self._label()
+        self._emit(PREDICATE, end)
+        if not self._check:
+            self.visit(node["expr"])
+            self._emit(FAIL_TWICE)
+            self._mark(end)
+            return
+        self._emit(MUTE, 1)
+        self.visit(node["expr"])
+        self._emit(MUTE, -1)
+        self._emit(FAIL_TWICE,
+                   "end of input" if node["expr"].name == "Any" else None)
+        self._mark(end)
+        self._emit(MUTE, -1)
+
+    def visit_Optional(self, node):
+        end = self._label()
+        self._emit(CHOICE, end)
+        self.visit(node["expr"])
+        self._emit(COMMIT, end)
+        self._mark(end)
+
+    def _loop(self, expr):
+        loop, end = self._label(), self._label()
+        self._mark(loop)
+        self._emit(CHOICE, end)
+        expr()
+        self._emit(COMMIT, loop)
+        self._mark(end)
+
+    def visit_Repeat(self, node):
+        self._loop(lambda: self.visit(node["expr"]))
+
+    def visit_Repeat1(self, node):
+        start = len(self._code)
+        self.visit(node["expr"])
+        body = self._code[start:]
+        cut = any(not isinstance(item, Label) and item[0] == CUT
+                  for item in body)
+        if len(body) == 1 and not isinstance(body[0], Label) and not cut:
+            self._loop(lambda: self._code.extend(body))
+            return
+        del self._code[start:]
+        label = self._label()
+        self._subroutines.append((label, body))
+        if cut:
+            fail, end = self._label(), self._label()
+            self._emit(CHOICE, fail)
+            self._emit(CALL, label)
+            self._emit(COMMIT, end)
+            self._mark(fail)
+            self._emit(FAIL)
+            self._mark(end)
+        else:
+            self._emit(CALL, label)
+        self._loop(lambda: self._emit(CALL, label))
+
+    def _tree_op(self, node, op, arg=None):
+        if self._recognize:
+            self.visit(node["expr"])
+            return
+        self._emit(BEGIN)
+        self.visit(node["expr"])
+        self._emit(op, arg)
+
+    def visit_Ignore(self, node):
+        if node["expr"].name == "Regex" and not self._check:
+            self._emit(SKIP, self._regex(node["expr"]))
+            return
+        self._tree_op(node, IGNORE)
+
+    def visit_Append(self, node):
+        self._tree_op(node, APPEND, node["name"].value)
+
+    def visit_Rappend(self, node):
+        self._tree_op(node, RAPPEND, node["name"].value)
+
+    def visit_Extend(self, node):
+        self._tree_op(node, EXTEND)
+
+    def visit_Rextend(self, node):
+        self._tree_op(node, REXTEND)
+
+    def visit_Tag(self, node):
+        if not self._recognize:
+            self._emit(TAG, node.value)
+
+    def visit_Identifier(self, node):
+        self._emit(CALL, self._rule(node.value))
+
+    def visit_Literal(self, node):
+        lit = "".join(self.visit(c) for c in node.values("char"))
+        self._emit(LITERAL, lit, len(lit))
+
+    def visit_Class(self, node):
+        self._emit(SET, CharClass.matcher(class_ranges(self, node)), False)
+
+    def visit_Range(self, node):
+        self._emit(RANGE, self.visit(node["start"]), self.visit(node["end"]))
+
+    def visit_Char(self, node):
+        self._emit(LITERAL, self.visit(node["char"]), 1)
+
+    def visit_Any(self, node):
+        self._emit(ANY)
+
+    def _regex(self, node):
+        return re.compile(node["pattern"].value, re.DOTALL)
+
+    def visit_Regex(self, node):
+        if self._check:
+            self.visit(node["expr"])
+            return
+        self._emit(REGEX, self._regex(node))
+
+    def visit_escape(self, node):
+        return {
+            "n": "\n",
+            "r": "\r",
+            "t": "\t",
+            "'": "'",
+            '"': '"',
+            "[": "[",
+            "]": "]",
+            "\\": "\\",
+        }[node.value]
+
+    def visit_octal(self, node):
+        return chr(int(node.value, 8))
+
+    def visit_char(self, node):
+        return node.value
+
+
+def compile_machine(grammar):
+    return Machine(MachineCompiler().visit(grammar),
+                   MachineCompiler(True).visit(grammar),
+                   MachineCompiler(check=True).visit(grammar))
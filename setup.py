@@ -8,9 +8,13 @@ here = path.abspath(path.dirname(__file__))
 with open(path.join(here, 'README.md'), encoding='utf-8') as f:
     long_description = f.read()
 
+version = {}
+with open(path.join(here, 'peg', 'version.py'), encoding='utf-8') as f:
+    exec(f.read(), version)
+
 setup(
     name='peg',
-    version='0.1.dev0',
+    version=version['__version__'],
     description='PEG parsing library',
     long_description=long_description,
     url='https://github.com/ethframe/peg',
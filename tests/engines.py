@@ -0,0 +1,66 @@
+from peg import (get_metagrammar, optimize_grammar, fuse_lexical,
+                 generate_parser, compile_parser, compile_machine)
+from peg.analysis import validate
+
+
+JSON = r"""
+Document <- _ Value !.
+Value    <- Object / Array / String / Number / True / False / Null
+Object   <- LBRACE @Object (Member:item (COMMA Member:item)*)? RBRACE
+Member   <- String @Member<:key COLON Value:value
+Array    <- LBRACKET @Array (Value:item (COMMA Value:item)*)? RBRACKET
+String   <- ["]~ (!["\\] . / '\\' .)* @String<< ["]~ _
+Number   <- '-'? ([0] / [1-9] [0-9]*) ('.' [0-9]+)?
+            ([eE] ('+' / '-')? [0-9]+)? @Number<< _
+True     <- 'true'~ @True _
+False    <- 'false'~ @False _
+Null     <- 'null'~ @Null _
+LBRACE   <- '{'~ _
+RBRACE   <- '}'~ _
+LBRACKET <- '['~ _
+RBRACKET <- ']'~ _
+COMMA    <- ','~ _
+COLON    <- ':'~ _
+_        <- ([ \t\r\n]*)~
+"""
+
+CHAIN = "\n".join(
+    "R{0} <- 'a{0}'~ R{1}:x @T{0} / 'z' @Z".format(i, i + 1)
+    for i in range(300)) + "\nR300 <- 'z' @Z\n"
+
+MODES = [(optimize, fuse) for optimize in (False, True)
+         for fuse in (False, True)]
+
+
+ENGINES = {
+    "interpreter": generate_parser,
+    "memo": lambda tree: generate_parser(tree, memoize=True),
+    "compiled": compile_parser,
+    "vm": compile_machine,
+}
+
+
+def grammar_tree(source, optimize=True, fuse=True):
+    tree = get_metagrammar().parse_strict(source)
+    validate(tree)
+    if optimize:
+        tree = optimize_grammar(tree)
+    if fuse:
+        tree = fuse_lexical(tree)
+    return tree
+
+
+def build(source, optimize=True, fuse=True):
+    tree = grammar_tree(source, optimize, fuse)
+    return {name: make(tree) for name, make in ENGINES.items()}
+
+
+def outcomes(parsers, text):
+    res = {}
+    for name, parser in parsers.items():
+        tree, end = parser.parse(text)
+        matched, match_end = parser.match(text)
+        assert matched == (tree is not None), name
+        assert match_end == end, name
+        res[name] = (None if tree is None else str(tree), end)
+    return res
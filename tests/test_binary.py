@@ -0,0 +1,25 @@
+import mmap
+
+import pytest
+
+from peg import parse_grammar
+
+
+@pytest.mark.parametrize("fuse", [False, True])
+def test_capture_type_follows_source(fuse, tmp_path):
+    parser = parse_grammar(r"S <- [a-z]+ [0-9]~ [a-z]+ @S<< / [a-z]+ @S<<",
+                           binary=True, fuse=fuse)
+    path = tmp_path / "input"
+    path.write_bytes(b"ab1cd")
+    with open(path, "rb") as fp:
+        mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        for source, kind in ((b"ab1cd", bytes), (b"abcd", bytes),
+                             (bytearray(b"ab1cd"), bytearray),
+                             (bytearray(b"abcd"), bytearray),
+                             (memoryview(b"ab1cd"), memoryview),
+                             (memoryview(b"abcd"), memoryview),
+                             (mapped, bytes)):
+            tree, end = parser.parse(source)
+            assert type(tree.value) is kind
+            assert bytes(tree.value) == b"abcd"
+        mapped.close()
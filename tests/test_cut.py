@@ -0,0 +1,66 @@
+import pytest
+
+from peg import parse_grammar
+from peg.peg import Context
+from peg.tree import EMPTY
+
+from engines import MODES, build, outcomes
+
+
+CASES = [
+    ("S <- (('a' ^ 'b' / 'c') / 'ad') !. @S",
+     {"ab": 2, "c": 1, "ad": 2, "ac": None}),
+    ("S <- ('a' ^ 'b' / 'ac') !. @S",
+     {"ab": 2, "ac": None}),
+    ("S <- ('x' ('a' ^ 'b' / 'c') / 'xad') !. @S",
+     {"xab": 3, "xc": 2, "xad": 3, "xae": None}),
+    ("S <- (('a' ^ 'b')* 'c' / ^ 'd') !. @S",
+     {"ababc": 5, "abac": None, "d": 1, "c": 1}),
+    ("S <- ('a' ^ 'b')? 'a' !. @S",
+     {"aba": 3, "a": None}),
+    ("S <- ('a' ^ 'b')+ 'c' !. @S",
+     {"ababc": 5, "abac": None, "c": None}),
+]
+
+
+@pytest.mark.parametrize("optimize,fuse", MODES)
+@pytest.mark.parametrize("grammar,inputs", CASES)
+def test_cut_scoping(grammar, inputs, optimize, fuse):
+    parsers = build(grammar, optimize, fuse)
+    for text, expected in inputs.items():
+        res = outcomes(parsers, text)
+        assert len(set(res.values())) == 1, (text, res)
+        tree, end = res["interpreter"]
+        if expected is None:
+            assert tree is None, text
+        else:
+            assert end == expected, text
+
+
+class SmallContext(Context):
+    MEMO_LIMIT = 512
+
+
+ITEMS = r"""
+S    <- @S _ Item:i* !.
+Item <- Key '='~ _ ^ @Item<:key Value:value
+      / Key ':'~ _ ^ @Pair<:key Value:value
+Key  <- [a-z]+ @Key<< _
+Value <- [0-9]+ @Num<< _
+_    <- ([ ]*)~
+"""
+
+
+@pytest.mark.parametrize("cut", [True, False])
+def test_cut_bounds_memo(cut):
+    grammar = ITEMS if cut else ITEMS.replace("^", "")
+    parser = parse_grammar(grammar, memoize=True)
+    text = " ".join(("abc = {}" if i % 2 else "abc : {}").format(i)
+                    for i in range(5000))
+    ctx = SmallContext()
+    tree, end = parser._parse(text, 0, EMPTY, ctx)
+    assert tree is not None and end == len(text)
+    if cut:
+        assert len(ctx.memo) < 4 * SmallContext.MEMO_LIMIT
+    else:
+        assert len(ctx.memo) >= 5000
@@ -0,0 +1,115 @@
+import os
+import pickle
+import random
+
+import pytest
+
+from peg import META_GRAMMAR, compile_machine
+
+from engines import JSON, MODES, build, grammar_tree, outcomes
+
+
+CALC = r"""
+Start  <- _ Expr !.
+Expr   <- Mult ((ADD / SUB)<:left Mult:right)*
+Mult   <- Term ((MUL / DIV)<:left Term:right)*
+Term   <- LP Expr RP / Number / NEG Term:expr
+Number <- ([0] / [1-9] [0-9]*) @Number<< _
+ADD    <- "+"~ _ @Add
+SUB    <- "-"~ _ @Sub
+MUL    <- "*"~ _ @Mul
+DIV    <- "/"~ _ @Div
+NEG    <- "-"~ _ @Neg
+LP     <- "("~ _
+RP     <- ")"~ _
+_      <- ([ \t\r\n]*)~
+"""
+
+
+def _calc(rng, depth=0):
+    r = rng.random()
+    if depth > 4 or r < 0.3:
+        return str(rng.randint(0, 999))
+    if r < 0.45:
+        return "(" + _calc(rng, depth + 1) + ")"
+    if r < 0.5:
+        return "-" + _calc(rng, depth + 1)
+    return "{} {} {}".format(_calc(rng, depth + 1), rng.choice("+-*/"),
+                             _calc(rng, depth + 1))
+
+
+def _json(rng, depth=0):
+    r = rng.random()
+    if depth > 3 or r < 0.4:
+        return rng.choice(["-12", "3.5e-2", "0", '"a \\"b\\""', "true",
+                           "false", "null"])
+    items = [_json(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+    if r < 0.7:
+        return "[" + ", ".join(items) + "]"
+    return "{" + ", ".join('"k{}": {}'.format(i, item)
+                           for i, item in enumerate(items)) + "}"
+
+
+def _mutate(rng, text):
+    for _ in range(2):
+        i = rng.randrange(len(text) + 1)
+        text = text[:i] + rng.choice(["", "(", "]", '"', " ", "1", "x"]) + \
+            text[i + 1:]
+    return text
+
+
+def _inputs(generate, seed, fixed):
+    rng = random.Random(seed)
+    texts = [generate(rng) for _ in range(10)]
+    texts += [_mutate(rng, text) for text in texts]
+    return fixed + texts
+
+
+def _grammar_txt():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        os.pardir, "grammar", "grammar.txt")
+    with open(path) as fp:
+        return fp.read()
+
+
+CASES = {
+    "calc": (CALC, lambda: _inputs(
+        _calc, 1, ["", "0", "01", "1 +", "--1", "(1) (2)"])),
+    "json": (JSON, lambda: _inputs(
+        _json, 2, ["", "[]", "{}", '{"a": }', "[1,]", "nul", '"\\'])),
+    "meta": (META_GRAMMAR, lambda: [
+        META_GRAMMAR, _grammar_txt(), CALC, JSON, "", "A <- 'a", "A <- [a-",
+        "A <- B\nB <- 'b' @B<<:x", "A <- ('a' ^ 'b')* @A"]),
+}
+
+
+@pytest.mark.parametrize("optimize,fuse", MODES)
+@pytest.mark.parametrize("case", sorted(CASES))
+def test_engines_agree(case, optimize, fuse):
+    grammar, inputs = CASES[case]
+    parsers = build(grammar, optimize, fuse)
+    accepted = 0
+    for text in inputs():
+        res = outcomes(parsers, text)
+        assert len(set(res.values())) == 1, (text, res)
+        accepted += res["interpreter"][0] is not None
+    assert accepted
+
+
+@pytest.mark.parametrize("case", sorted(CASES))
+def test_pickled_engines_agree(case):
+    grammar, inputs = CASES[case]
+    parsers = build(grammar)
+    loaded = {name: pickle.loads(pickle.dumps(parser))
+              for name, parser in parsers.items()}
+    for text in inputs()[:8]:
+        assert outcomes(loaded, text) == outcomes(parsers, text), text
+
+
+def test_machine_parses_deep_nesting():
+    parser = compile_machine(grammar_tree(CALC))
+    text = "(" * 50000 + "1" + ")" * 50000
+    tree, end = parser.parse(text)
+    assert tree is not None and end == len(text)
+    assert parser.match(text) == (True, len(text))
+    assert parser.parse(text[:-1]) == (None, 0)
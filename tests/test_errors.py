@@ -0,0 +1,81 @@
+import mmap
+
+import pytest
+
+from peg import parse_grammar, ParseError
+
+from engines import JSON, MODES, build
+
+
+TEXTS = ['{"a": [1, 2]}', '{"a" 1}', '[1, 2', '[tru]', '{"ab', '1.', '[1]\nx',
+         '', '[1,\n 2.x]']
+
+
+def _outcome(parser, text):
+    try:
+        return str(parser.parse_strict(text))
+    except ParseError as e:
+        return e.pos, e.line, e.col, e.expected
+
+
+@pytest.mark.parametrize("optimize,fuse", MODES)
+def test_engines_agree_on_errors(optimize, fuse):
+    parsers = build(JSON, optimize, fuse)
+    for text in TEXTS:
+        res = {name: _outcome(parser, text)
+               for name, parser in parsers.items()}
+        assert len(set(res.values())) == 1, (text, res)
+        tree, end = parsers["interpreter"].parse(text)
+        if tree is not None and end == len(text):
+            assert res["interpreter"] == str(tree), text
+
+
+@pytest.mark.parametrize("optimize", [False, True])
+def test_memo_replays_failures(optimize):
+    parsers = build("S <- (!A 'c' / A) !. @S\nA <- 'a' 'b' @A\n", optimize,
+                    False)
+    res = {name: _outcome(parser, "ax") for name, parser in parsers.items()}
+    assert len(set(res.values())) == 1, res
+
+
+@pytest.mark.parametrize("optimize,fuse", MODES)
+def test_fused_failure_is_precise(optimize, fuse):
+    for parser in build("S <- [a-z]+ @S !.\n", optimize, fuse).values():
+        with pytest.raises(ParseError) as info:
+            parser.parse_strict("ab1")
+        assert info.value.col == 3
+        assert "end of input" in info.value.expected
+
+
+@pytest.mark.parametrize("lines", [1, 40000])
+def test_buffer_sources(tmp_path, lines):
+    parser = parse_grammar(r"S <- @S ('ab' [0-9]* [\n])* !.", binary=True)
+    data = b"ab1\n" * lines + b"ab12x\n"
+    path = tmp_path / "input"
+    path.write_bytes(data)
+    with open(path, "rb") as fp:
+        mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        for source in (data, bytearray(data), memoryview(data), mapped):
+            with pytest.raises(ParseError) as info:
+                parser.parse_strict(source)
+            assert (info.value.line, info.value.col) == (lines + 1, 5)
+        mapped.close()
+
+
+def test_class_members_are_escaped():
+    parser = parse_grammar(r"S <- [\]a^\\,--] @S")
+    with pytest.raises(ParseError) as info:
+        parser.parse_strict("x")
+    assert info.value.expected == (r"[,-\-\\-\^a]",)
+
+
+@pytest.mark.parametrize("optimize,fuse", MODES)
+def test_merged_literals_fail_precisely(optimize, fuse):
+    grammar = "S <- 'a' 'b' T @S\nT <- 'cd'~ 'e'~ 'f'~\n"
+    for text, col, expected in [("ax", 2, "'b'"), ("abcdx", 5, "'e'"),
+                                ("abcx", 3, "'cd'")]:
+        for name, parser in build(grammar, optimize, fuse).items():
+            with pytest.raises(ParseError) as info:
+                parser.parse_strict(text)
+            assert (info.value.col, info.value.expected) == \
+                (col, (expected,)), (name, text)
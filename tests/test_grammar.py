@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from peg import Grammar, Literal
+
+
+def _grammar():
+    g = Grammar()
+    g("S", g("A") * g("B").rep())
+    g("A", Literal("a"))
+    g("B", g("A") | Literal("b"))
+    return g
+
+
+def test_freeze_links_rules():
+    g = _grammar().freeze()
+    assert g.frozen
+    assert g.freeze() is g
+    assert g("S").match("abab") == (True, 4)
+
+
+def test_freeze_rejects_redefinition():
+    g = _grammar().freeze()
+    with pytest.raises(ValueError, match="Rule A redefined after freeze"):
+        g("A", Literal("x"))
+    with pytest.raises(ValueError, match="Rule C undefined"):
+        g("C")
+
+
+def test_freeze_reports_undefined_rules():
+    g = _grammar()
+    g("C", g("D") | g("E") * g("A"))
+    with pytest.raises(ValueError, match="Rules D, E undefined"):
+        g.freeze()
+    assert not g.frozen
+
+
+def test_freeze_rejects_rule_cycles():
+    g = Grammar()
+    g("S", g("A"))
+    g("A", g("S"))
+    with pytest.raises(ValueError, match="not well-formed"):
+        g.freeze()
+
+
+def test_import_is_lazy():
+    code = ("import sys, peg, peg.grammar; "
+            "print(peg.grammar._metagrammar is None, sorted(set(sys.modules) "
+            "& {'hashlib', 'pickle', 'tempfile', 'zlib'}))")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run([sys.executable, "-c", code], cwd=root, check=True,
+                         stdout=subprocess.PIPE, universal_newlines=True)
+    assert out.stdout.split() == ["True", "[]"]
@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+from peg import parse_grammar, IncrementalParser
+
+
+GRAMMAR = r"""
+Lines  <- @Lines _ (Line:line)* !.
+Line   <- Expr ';'~ _
+Expr   <- Term ((ADD / SUB)<:left Term:right)*
+Term   <- '('~ _ Expr ')'~ _ / Number / Name
+Number <- [0-9]+ @Number<< _
+Name   <- [a-z]+ ![(] @Name<< _
+ADD    <- '+'~ _ @Add
+SUB    <- '-'~ _ @Sub
+_      <- ([ \n]*)~
+"""
+
+
+def _source(rng, lines):
+    return "".join("{} + ({} - x{});\n".format(
+        rng.randint(0, 999), rng.randint(0, 999), "y" * rng.randint(0, 3))
+        for _ in range(lines))
+
+
+@pytest.mark.parametrize("fuse", [False, True])
+def test_edits_match_full_parse(fuse):
+    rng = random.Random(fuse)
+    parser = parse_grammar(GRAMMAR, memoize=True, fuse=fuse)
+    reference = parse_grammar(GRAMMAR, fuse=fuse)
+    inc = IncrementalParser(parser)
+    source = _source(rng, 200)
+    inc.parse(source)
+    for _ in range(20):
+        start = rng.randrange(len(source))
+        old_len = rng.randint(0, 3)
+        new_text = rng.choice(["", "1", "+", " ", "(", ")", ";\n", "ab"])
+        source = source[:start] + new_text + source[start + old_len:]
+        tree, end = inc.edit(start, min(old_len, len(inc.source) - start),
+                             new_text)
+        assert inc.source == source
+        expected, expected_end = reference.parse(source)
+        if expected is None:
+            assert tree is None
+        else:
+            assert (str(tree), end) == (str(expected), expected_end)
+
+
+@pytest.mark.parametrize("fuse", [False, True])
+def test_edit_reuses_memo(fuse):
+    parser = parse_grammar(GRAMMAR, memoize=True, fuse=fuse)
+    inc = IncrementalParser(parser)
+    source = _source(random.Random(0), 500)
+    inc.parse(source)
+    parser.grammar.reset_stats()
+    pos = source.index("+", len(source) // 2) - 2
+    inc.edit(pos, 1, "7")
+    misses = sum(stats[1] for stats in parser.grammar.memo_stats().values())
+    assert misses < 50
+
+
+def test_requires_memoization():
+    with pytest.raises(ValueError):
+        IncrementalParser(parse_grammar(GRAMMAR))
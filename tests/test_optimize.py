@@ -0,0 +1,48 @@
+from peg import parse_grammar, get_metagrammar, optimize_grammar
+
+from engines import CHAIN
+
+
+MIXED = r"""
+S <- (A / B / 'x' / 'y' / [0-3] / 'q'~ / 'r'~)* !. @S
+A <- 'a' 'b' 'c' @A<<
+B <- ('d'~ 'e'~ ('f' / 'g'))~ @B
+U <- 'unused' @U
+"""
+
+
+def test_long_rule_chain():
+    text = "a0a1a2z"
+    optimized = parse_grammar(CHAIN)
+    plain = parse_grammar(CHAIN, optimize=False)
+    assert str(optimized.parse(text)[0]) == str(plain.parse(text)[0])
+
+
+def test_trees_unchanged():
+    optimized = parse_grammar(MIXED)
+    plain = parse_grammar(MIXED, optimize=False)
+    for text in ("abcdefxy0123qrdeg", "abx", "zz", ""):
+        tree, end = optimized.parse(text)
+        expected, expected_end = plain.parse(text)
+        assert (str(tree), end) == (str(expected), expected_end)
+
+
+def test_prune():
+    tree = get_metagrammar().parse_strict(MIXED)
+    names = [rule["name"].value
+             for rule in optimize_grammar(tree, prune=True).values("rule")]
+    assert names == ["S", "A", "B"]
+    assert parse_grammar(MIXED).grammar("U").parse("unused")[1] == 6
+
+
+def test_profile_keeps_rules():
+    grammar = r"""
+    S <- _ (Word _)* !. @S
+    Word <- [a-z]+ @Word<<
+    _ <- ([ ]*)~
+    """
+    parser = parse_grammar(grammar, profile=True)
+    parser.parse("ab cd ef")
+    stats = parser.grammar.profile_stats()
+    assert stats["_"][0] == 4
+    assert stats["Word"][0] == 4
@@ -0,0 +1,62 @@
+import pytest
+
+from peg import parse_grammar, parse_many
+
+
+WORDS = r"S <- @S ([a-z]+ @W<< ' '?)* !."
+
+
+def _results(results):
+    return {index: (str(tree), end, error)
+            for index, tree, end, error in results}
+
+
+@pytest.mark.parametrize("ordered", [False, True])
+def test_results_match_serial_parse(ordered):
+    parser = parse_grammar(WORDS)
+    inputs = ["ab cd", "x" * 50, "a1", ""] * 10
+    results = list(parse_many(WORDS, inputs, workers=2, chunksize=3,
+                              ordered=ordered))
+    indices = [index for index, _, _, _ in results]
+    if ordered:
+        assert indices == list(range(len(inputs)))
+    assert sorted(indices) == list(range(len(inputs)))
+    for index, tree, end, error in results:
+        expected, expected_end = parser.parse(inputs[index])
+        assert (str(tree), end, error) == (str(expected), expected_end, None)
+
+
+class Unpicklable(Exception):
+    def __reduce__(self):
+        raise TypeError("cannot pickle")
+
+
+class Failing:
+    def parse(self, s):
+        if s == "bad":
+            raise ValueError(s)
+        if s == "worse":
+            raise Unpicklable(s)
+        return None, 0
+
+
+def test_errors_are_reported_per_item():
+    results = _results(parse_many(Failing(), ["ok", "bad", "worse", "ok"],
+                                  workers=2, chunksize=1))
+    assert sorted(results) == [0, 1, 2, 3]
+    assert results[0] == results[3] == ("None", 0, None)
+    assert isinstance(results[1][2], ValueError)
+    assert str(results[1][2]) == "bad"
+    assert isinstance(results[2][2], RuntimeError)
+    assert "Unpicklable" in str(results[2][2])
+
+
+def test_buffer_inputs():
+    parser = parse_grammar(WORDS, binary=True)
+    data = b"ab cd"
+    results = _results(parse_many(parser, [data, memoryview(data),
+                                           bytearray(data)],
+                                  workers=2, chunksize=1))
+    expected = str(parser.parse(data)[0]), len(data), None
+    assert results[0] == results[1] == expected
+    assert results[2][1:] == (len(data), None)
@@ -0,0 +1,35 @@
+from peg import parse_grammar
+
+
+PAIRS = r"""
+S   <- @S (Key '=' Num ';')* !.
+Key <- [a-z]+ @Key<<
+Num <- [0-9]+ @Num<<
+"""
+
+
+def _rows(report):
+    lines = report.splitlines()
+    assert lines[0].split() == ["rule", "calls", "successes", "failures",
+                                "cumulative", "self", "backtracked"]
+    return {line.split()[0]: line.split()[1:] for line in lines[1:]}
+
+
+def test_report_counts_fused_rules():
+    parser = parse_grammar(PAIRS, profile=True)
+    assert parser.parse("a=1;bb=22;")[1] == 10
+    rows = _rows(parser.grammar.report(sort="calls"))
+    assert list(rows) == ["Key", "Num", "S"]
+    assert rows["Key"][:3] == ["3", "2", "1"]
+    assert rows["Num"][:3] == ["2", "2", "0"]
+    assert list(_rows(parser.grammar.report("calls", 1))) == ["Key"]
+
+
+def test_report_counts_terminals_before_backtracking():
+    parser = parse_grammar("S <- A / 'abd' @S\nA <- [a]~ [b]~ [c]~ @A\n",
+                           profile=True)
+    assert parser.parse("abd")[1] == 3
+    rows = _rows(parser.grammar.report())
+    assert rows["A"][:3] == ["1", "0", "1"]
+    assert rows["A"][5] == "2"
+    assert rows["S"][5] == "0"
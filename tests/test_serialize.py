@@ -0,0 +1,63 @@
+import pickle
+
+import pytest
+
+from peg import grammar, parse_grammar, dump_parser, load_parser
+
+from engines import CHAIN
+
+
+TEXT = "a0a1a2z"
+
+
+@pytest.mark.parametrize("options", [
+    {}, {"optimize": False}, {"memoize": True}, {"profile": True},
+])
+def test_dump_load_round_trip(options):
+    parser = parse_grammar(CHAIN, **options)
+    loaded = load_parser(dump_parser(parser))
+    assert str(loaded.parse(TEXT)[0]) == str(parser.parse(TEXT)[0])
+    assert loaded.grammar.frozen
+
+
+def test_pickled_rules_share_grammar():
+    parser = parse_grammar(CHAIN, optimize=False)
+    loaded = pickle.loads(pickle.dumps(parser))
+    assert loaded.grammar("R1").grammar is loaded.grammar
+    assert loaded.grammar("R1").parse("a1z")[1] == 3
+
+
+def test_cache_dir_round_trip(tmp_path):
+    parser = parse_grammar(CHAIN, cache_dir=str(tmp_path))
+    assert len(list(tmp_path.iterdir())) == 1
+    cached = parse_grammar(CHAIN, cache_dir=str(tmp_path))
+    assert str(cached.parse(TEXT)[0]) == str(parser.parse(TEXT)[0])
+
+
+def test_memory_cache_returns_independent_parsers():
+    first = parse_grammar(CHAIN, memoize=True, cache=True)
+    second = parse_grammar(CHAIN, memoize=True, cache=True)
+    assert first is not second
+    assert first.grammar is not second.grammar
+    first.parse(TEXT)
+    assert any(hits or misses for hits, misses
+               in first.grammar.memo_stats().values())
+    assert not any(hits or misses for hits, misses
+                   in second.grammar.memo_stats().values())
+    assert str(second.parse(TEXT)[0]) == str(first.parse(TEXT)[0])
+
+
+@pytest.mark.parametrize("damage", [
+    lambda data: data[:len(data) // 2],
+    lambda data: data[:6] + bytes(len(data) - 6),
+    lambda data: b"",
+])
+def test_corrupt_cache_file_is_rebuilt(tmp_path, damage):
+    grammar._cache.clear()
+    parse_grammar(CHAIN, cache_dir=str(tmp_path))
+    path, = tmp_path.iterdir()
+    path.write_bytes(damage(path.read_bytes()))
+    grammar._cache.clear()
+    parser = parse_grammar(CHAIN, cache_dir=str(tmp_path))
+    assert parser.parse(TEXT)[1] == len(TEXT)
+    assert load_parser(path.read_bytes()).parse(TEXT)[1] == len(TEXT)
@@ -0,0 +1,52 @@
+import io
+
+import pytest
+
+from peg import parse_grammar, parse_iter
+
+
+CHUNK_SIZES = [1, 2, 3, 7, 16, 1 << 16]
+
+RECORDS = r"""
+Record <- Key @Record<:key '='~ _ Value:value ';'~ _
+Key    <- [a-z]+ @Key<< _
+Value  <- [0-9]+ @Num<< _ / '"'~ (!'"' .)* @Str<< '"'~ _
+_      <- ([ ]*)~
+"""
+
+
+def _items(item, text, chunk_size, separator=None):
+    return [str(tree) for tree in parse_iter(io.StringIO(text), item,
+                                             separator, chunk_size)]
+
+
+@pytest.mark.parametrize("fuse", [False, True])
+def test_items_do_not_depend_on_chunk_size(fuse):
+    item = parse_grammar(r"Item <- ('x'* 'y') @Long<< / 'x' @Short<<",
+                         fuse=fuse)
+    text = "x" * 100 + "y" + "x"
+    for chunk_size in CHUNK_SIZES:
+        assert _items(item, text, chunk_size) == ["Long('{}')".format(
+            "x" * 100 + "y"), "Short('x')"], chunk_size
+
+
+@pytest.mark.parametrize("fuse", [False, True])
+def test_separated_records(fuse):
+    item = parse_grammar(RECORDS, fuse=fuse)
+    separator = parse_grammar(r"Sep <- [\n]+", fuse=fuse)
+    text = "\n".join('key = {0};\ns = "{1}";'.format(i, " " * i)
+                     for i in range(30))
+    expected = _items(item, text, 1 << 16, separator)
+    assert len(expected) == 60
+    for chunk_size in CHUNK_SIZES:
+        assert _items(item, text, chunk_size, separator) == expected
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+def test_trailing_garbage(chunk_size):
+    item = parse_grammar(RECORDS)
+    with pytest.raises(ValueError, match="offset 12"):
+        _items(item, "a = 1;b = 2;!", chunk_size)
+    nullable = parse_grammar(r"I <- [a-z]* @I<<")
+    with pytest.raises(ValueError, match="consumed no input"):
+        _items(nullable, "ab!", chunk_size)
@@ -0,0 +1,64 @@
+import pytest
+
+from peg.tree import EMPTY, Named, Node
+
+from engines import build
+
+
+def test_appends_share_storage():
+    node = Node("N", [], 0)
+    versions = [node]
+    for i in range(1000):
+        node = node.append("item", Named(str(i)))
+        versions.append(node)
+    assert all(version._values is node._values for version in versions)
+    assert [v.name for _, v in node.finalize()] == [str(i)
+                                                    for i in range(1000)]
+    assert [v.name for _, v in versions[3].finalize()] == ["0", "1", "2"]
+
+
+def test_append_after_backtrack_overwrites():
+    start = Node("N", [], 0).append("a", Named("A"))
+    start.append("b", Named("B")).append("c", Named("C"))
+    retry = start.append("d", Named("D"))
+    assert [(n, v.name) for n, v in retry.finalize()] == [("a", "A"),
+                                                          ("d", "D")]
+    assert len(start.finalize()._values) == 1
+
+
+def test_spans_share_storage():
+    text = "abcdef" * 100
+    string = EMPTY.extend_span(text, 0, 1)
+    first = string
+    for i in range(1, len(text)):
+        string = string.extend_span(text, i, i + 1)
+    assert string._spans is first._spans
+    assert string.fork()._spans is not first._spans
+    assert first.extend_span(text, 3, 4)._len == 4
+
+
+def test_backtracked_items_are_dropped():
+    grammar = r"""
+    S <- @S (Item:first ';'~ / Item:second ','~)* !.
+    Item <- [a-z]+ @Item<<
+    """
+    for name, parser in build(grammar).items():
+        tree, end = parser.parse("ab,cd;ef,")
+        assert end == 9, name
+        assert [(n, v.value) for n, v in tree] == [
+            ("second", "ab"), ("first", "cd"), ("second", "ef")], name
+
+
+def test_node_index_is_built_on_first_lookup():
+    node = Node("N", [], 0)
+    for name in ("a", "b", "a"):
+        node = node.append(name, Named(name.upper()))
+    node = node.finalize()
+    assert node._values_dict is None
+    assert str(node) == "N(\n    a=A,\n    b=B,\n    a=A)"
+    assert node._values_dict is None
+    assert node["b"].name == "B"
+    assert [v.name for v in node.values("a")] == ["A", "A"]
+    assert node._values_dict is not None
+    with pytest.raises(KeyError):
+        node["a"]